@@ -69,6 +69,8 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "mainapp.middleware.IdentityMapMiddleware",
+    "mainapp.middleware.StudentMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -93,9 +95,7 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
-                "mainapp.context_processors.is_professor",
-                "mainapp.context_processors.get_class_color",
-                "mainapp.context_processors.is_assigned_professor",
+                "mainapp.context_processors.user_context",
             ],
         },
     },
@@ -200,6 +200,68 @@ LOGOUT_REDIRECT_URL = "/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# cache in front of google calendar event listings (see mainapp/event_cache.py)
+# seconds before a cached listing is fetched again, 0 turns the cache off
+EVENT_CACHE_TTL = int(os.getenv("EVENT_CACHE_TTL", 300))
+EVENT_CACHE_MAX_ENTRIES = 512
+# name of a django cache (see CACHES) to share cached events between workers, or None
+# the cache is off while this is None, since a write in one worker would not reach the others
+EVENT_CACHE_BACKEND = os.getenv("EVENT_CACHE_BACKEND")
+
+# cache of rendered calendar months and todo lists (see mainapp/fragment_cache.py)
+# seconds a fragment is kept, 0 turns the cache off
+FRAGMENT_CACHE_TTL = int(os.getenv("FRAGMENT_CACHE_TTL", 300))
+FRAGMENT_CACHE_MAX_ENTRIES = 1024
+# shares rendered fragments (and their version stamps) between workers, like EVENT_CACHE_BACKEND
+# the cache is off while this is None, since workers could not tell each other about changes
+FRAGMENT_CACHE_BACKEND = EVENT_CACHE_BACKEND
+
+# calendars of one page are fetched concurrently, at most this many at a time
+CALENDAR_FETCH_MAX_IN_FLIGHT = 8
+# seconds before a single calendar fetch is given up on
+CALENDAR_FETCH_TIMEOUT = 10
+
+# seconds before a calendar in the local event store is synced with google again
+CALENDAR_SYNC_INTERVAL = 300
+
+# smtp server notifications are sent through (see mainapp/email_service.py)
+# to try sending locally, run a stand-in (python -m aiosmtpd -n -l localhost:8025) and set
+# EMAIL_HOST=localhost EMAIL_PORT=8025 EMAIL_USE_TLS=false
+EMAIL_HOST = os.getenv("EMAIL_HOST", "smtp.gmail.com")
+EMAIL_PORT = int(os.getenv("EMAIL_PORT", 587))
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "true").lower() == "true"
+# smtp connections the email service keeps open, and so how many emails are sent at once
+EMAIL_POOL_SIZE = 4
+# seconds a pooled connection may sit idle before it is checked with NOOP
+EMAIL_KEEPALIVE = 30
+
+# the notification queue is sent to this many email addresses at a time
+NOTIFICATION_CHUNK_SIZE = 100
+# seconds a worker may take to send a chunk before another worker may take it over
+NOTIFICATION_CLAIM_LEASE = 600
+# queued notifications wake the daemon up right away (on postgres), and the queue is
+# also checked this often (seconds) in case a wakeup was lost
+NOTIFICATION_SWEEP_INTERVAL = 3600
+# the daily digest is put together and queued for this many students at a time
+DIGEST_CHUNK_SIZE = 500
+# the daily digest is sent from this hour on, in the time zone of each student
+DIGEST_HOUR = 1
+# minutes between digest runs. the students of a time zone are spread over the runs of an hour
+DIGEST_BUCKET_MINUTES = 10
+
+# the daemon checks for due jobs this often (seconds)
+SCHEDULER_POLL_INTERVAL = 10
+# seconds the daemon running the jobs holds its leader lock without renewing it, so longer
+# than any one job takes
+SCHEDULER_LEASE = 900
+# a failed job is retried this many times, waiting SCHEDULER_RETRY_BACKOFF seconds (doubling)
+SCHEDULER_MAX_RETRIES = 3
+SCHEDULER_RETRY_BACKOFF = 30
+
+# calendars of new users are created in the background. seconds a worker may take to create
+# one before another worker is allowed to try again
+CALENDAR_PROVISION_LEASE = 60
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
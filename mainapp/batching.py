@@ -0,0 +1,34 @@
+from . import services
+
+# the calendar api accepts up to 50 requests in a single batch
+# batch documentation : https://developers.google.com/calendar/api/guides/batch
+MAX_BATCH_SIZE = 50
+
+
+def execute_batched(requests):
+    """
+    Executes a list of api requests (e.g. events().list(...)), up to MAX_BATCH_SIZE per http round trip
+    Returns a list of (response, exception) in the same order as requests. A failing request
+    only fails its own item, the rest of the batch still goes through
+    """
+    results = [(None, None)] * len(requests)
+
+    # the faked service used by tests cannot batch, so just run requests one at a time
+    if not hasattr(services.calendar_service, "new_batch_http_request"):
+        for i, request in enumerate(requests):
+            try:
+                results[i] = (request.execute(http=services.thread_http()), None)
+            except Exception as e:
+                results[i] = (None, e)
+        return results
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    for offset in range(0, len(requests), MAX_BATCH_SIZE):
+        batch = services.calendar_service.new_batch_http_request()
+        for i, request in enumerate(requests[offset : offset + MAX_BATCH_SIZE]):
+            batch.add(request, callback=callback, request_id=str(offset + i))
+        batch.execute(http=services.thread_http())
+
+    return results
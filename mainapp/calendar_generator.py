@@ -13,41 +13,54 @@ class Calendar(HTMLCalendar):
         super(Calendar, self).__init__()
 
     # formats a day as a td
-    # filter events by day
-    def formatday(self, day, events, request):
-        events_per_day = [
-            event
-            for event in events
-            if datetime.fromisoformat(event["end"]["dateTime"]).day == day
-        ]
-        d = ""
-        for event in events_per_day:
-            d += f"""
-			<div style="z-index:9999; padding-left:10px;width:100%;border-radius:100px;color:white;margin-bottom:5px; background-color:{tools.get_color(request, event['className'])}">
+    # events are the events due on that day, colors maps their classNames to colors
+    def formatday(self, day, events, colors):
+        if day == 0:
+            return "<td></td>"
+        d = "".join(
+            f"""
+			<div style="z-index:9999; padding-left:10px;width:100%;border-radius:100px;color:white;margin-bottom:5px; background-color:{colors[event['className']]}">
 				{event['summary']}
 			</div>
 			"""
-
-        if day != 0:
-            return f"<td><span class='date'>{day}</span><ul> {d} </ul></td>"
-        return "<td></td>"
+            for event in events
+        )
+        return f"<td><span class='date'>{day}</span><ul> {d} </ul></td>"
 
     # formats a week as a tr
-    def formatweek(self, theweek, events, request):
-        week = ""
-        for d, _ in theweek:
-            week += self.formatday(d, events, request)
+    def formatweek(self, theweek, days, colors):
+        week = "".join(self.formatday(d, days.get(d, []), colors) for d, _ in theweek)
         return f"<tr> {week} </tr>"
 
     # formats a month as a table
     # filter events by year and month
 
     def formatmonth(self, request, withyear=True):
+        return tools.cached_fragment(
+            request,
+            ("month", self.year, self.month, withyear),
+            lambda: self.rendermonth(request, withyear),
+        )
+
+    # renders a month, without the fragment cache
+    def rendermonth(self, request, withyear=True):
         events = tools.get_events(request, month=self.month, year=self.year)
-        cal = f'<table border="0" cellpadding="0" cellspacing="0" class="calendar">\n'
-        cal += f"{self.formatmonthname(self.year, self.month, withyear=withyear)}\n"
-        cal += f"{self.formatweekheader()}\n"
-        for week in self.monthdays2calendar(self.year, self.month):
-            cal += f"{self.formatweek(week, events, request)}\n"
-        return cal
+        # bucket the events by day and look up the color of every class once,
+        # so the cells below only do dictionary lookups
+        days = {}
+        for event in events:
+            day = datetime.fromisoformat(event["end"]["dateTime"]).day
+            days.setdefault(day, []).append(event)
+        colors = {
+            className: tools.get_color(request, className)
+            for className in {event["className"] for event in events}
+        }
 
+        cal = [
+            f'<table border="0" cellpadding="0" cellspacing="0" class="calendar">\n',
+            f"{self.formatmonthname(self.year, self.month, withyear=withyear)}\n",
+            f"{self.formatweekheader()}\n",
+        ]
+        for week in self.monthdays2calendar(self.year, self.month):
+            cal.append(f"{self.formatweek(week, days, colors)}\n")
+        return "".join(cal)
@@ -0,0 +1,200 @@
+import datetime
+import pytz
+from functools import partial
+from django.conf import settings
+from django.db import transaction
+from googleapiclient.errors import HttpError
+from . import batching, models, services, tools
+
+# syncs calendars in the local event store (models.CalendarEvent) with google calendar
+# the first sync of a calendar lists every event, and afterwards the syncToken google hands
+# back is used to only pull what changed since the last sync
+# incremental sync documentation : https://developers.google.com/calendar/api/guides/sync
+
+
+def parse_time(event_time):
+    """
+    Parses the dateTime of an event start/end, assuming utc if no offset is given
+    """
+    time = datetime.datetime.fromisoformat(event_time["dateTime"])
+    if time.tzinfo == None:
+        time = pytz.utc.localize(time)
+    return time
+
+
+def list_request(calendarId, syncToken="", page_token=None):
+    """
+    Builds (but does not execute) the api request listing one page of changes in calendarId
+    """
+    params = {}
+    if syncToken != "":
+        params["syncToken"] = syncToken
+    if page_token != None:
+        params["pageToken"] = page_token
+    return services.calendar_service.events().list(
+        calendarId=calendarId, maxResults=2500, **params
+    )
+
+
+def token_expired(error, syncToken):
+    """
+    Returns whether an api error means google expired our syncToken (410 GONE)
+    """
+    return isinstance(error, HttpError) and error.resp.status == 410 and syncToken != ""
+
+
+def fetch_changes(calendarId, syncToken="", page=None):
+    """
+    Lists the events that changed in calendarId since syncToken, or every event if there is no token
+    page is the first page of results, if it was already fetched (by a batch)
+    Returns (events, next sync token, whether this was a full sync)
+    Only talks to the api, so it is safe to run from a worker thread
+    """
+    events = []
+    page_token = None
+    while True:
+        if page == None:
+            try:
+                page = list_request(calendarId, syncToken, page_token).execute(
+                    http=services.thread_http()
+                )
+            except HttpError as e:
+                # start over with a full sync
+                if token_expired(e, syncToken):
+                    print(f"Sync token expired for {calendarId}, doing a full sync")
+                    return fetch_changes(calendarId)
+                raise
+        events += page["items"]
+        page_token = page.get("nextPageToken")
+        if page_token == None:
+            return events, page.get("nextSyncToken", ""), syncToken == ""
+        page = None
+
+
+def apply_changes(calendarId, events, syncToken, full):
+    """
+    Writes fetched changes into the local event store
+    A full sync replaces everything stored for the calendar
+    """
+    with transaction.atomic():
+        stored = models.CalendarEvent.objects.filter(calendarId=str(calendarId))
+        if full:
+            stored.delete()
+        for event in events:
+            if event.get("status") == "cancelled":
+                stored.filter(eventId=event["id"]).delete()
+            else:
+                store_event(calendarId, event)
+        if full or len(events) != 0:
+            tools.calendar_changed(calendarId)
+        models.CalendarSyncState.objects.update_or_create(
+            calendarId=str(calendarId),
+            defaults={
+                "syncToken": syncToken,
+                "synced_at": datetime.datetime.now(tz=pytz.utc),
+            },
+        )
+
+
+def store_event(calendarId, event):
+    """
+    Adds or updates a single event in the local event store
+    Events without a start and end time (all day events) are not stored
+    """
+    if "dateTime" not in event.get("start", {}) or "dateTime" not in event.get(
+        "end", {}
+    ):
+        return
+    models.CalendarEvent.objects.update_or_create(
+        calendarId=str(calendarId),
+        eventId=str(event["id"]),
+        defaults={
+            "start": parse_time(event["start"]),
+            "end": parse_time(event["end"]),
+            "data": event,
+        },
+    )
+
+
+def forget_event(calendarId, eventId):
+    """
+    Removes a single event from the local event store
+    """
+    models.CalendarEvent.objects.filter(
+        calendarId=str(calendarId), eventId=str(eventId)
+    ).delete()
+
+
+def sync_calendars(calendarIds, force=False):
+    """
+    Brings every calendar in calendarIds up to date with google, unless it was synced
+    less than settings.CALENDAR_SYNC_INTERVAL seconds ago (or force is set)
+    Changes are fetched in batches and concurrently, then written to the database from this thread
+    """
+    states = {
+        state.calendarId: state
+        for state in models.CalendarSyncState.objects.filter(
+            calendarId__in=[str(calendarId) for calendarId in calendarIds]
+        )
+    }
+
+    fresh_after = datetime.datetime.now(tz=pytz.utc) - datetime.timedelta(
+        seconds=getattr(settings, "CALENDAR_SYNC_INTERVAL", 300)
+    )
+    stale = []
+    for calendarId in dict.fromkeys(calendarIds):
+        state = states.get(str(calendarId))
+        if (
+            force
+            or state == None
+            or state.synced_at == None
+            or state.synced_at < fresh_after
+        ):
+            stale.append((calendarId, "" if state == None else state.syncToken))
+
+    # the first page of every calendar goes out in batches, which is all most calendars need
+    first_pages = batching.execute_batched(
+        [list_request(calendarId, syncToken) for calendarId, syncToken in stale]
+    )
+
+    synced = []
+    calls = []
+    for (calendarId, syncToken), (page, error) in zip(stale, first_pages):
+        if error == None and page.get("nextPageToken") == None:
+            changes = (page["items"], page.get("nextSyncToken", ""), syncToken == "")
+            synced.append((calendarId, changes))
+        elif error == None:
+            calls.append((calendarId, partial(fetch_changes, calendarId, syncToken, page)))
+        elif token_expired(error, syncToken):
+            print(f"Sync token expired for {calendarId}, doing a full sync")
+            calls.append((calendarId, partial(fetch_changes, calendarId)))
+        else:
+            # keep serving what is stored, and try again on the next read
+            print(f"Could not sync calendar {calendarId}: {error}")
+
+    # calendars with more pages, or that need a full sync, are finished concurrently
+    results = tools.fetch_concurrently(
+        [call for calendarId, call in calls], return_errors=True
+    )
+    for (calendarId, call), (changes, error) in zip(calls, results):
+        if error == None:
+            synced.append((calendarId, changes))
+        else:
+            # like a failed first page, one bad or slow calendar does not fail the others
+            print(f"Could not sync calendar {calendarId}: {error!r}")
+
+    for calendarId, (events, syncToken, full) in synced:
+        apply_changes(calendarId, events, syncToken, full)
+
+
+def stored_events(calendarId, timeMin=None, timeMax=None):
+    """
+    Returns the stored events of a calendar overlapping [timeMin, timeMax), like the api would
+    Events are returned in the order they were stored
+    """
+    query = models.CalendarEvent.objects.filter(calendarId=str(calendarId))
+    if timeMin != None:
+        query = query.filter(end__gt=timeMin)
+    if timeMax != None:
+        query = query.filter(start__lt=timeMax)
+    return [event.data for event in query.order_by("id")]
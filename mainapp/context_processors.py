@@ -1,17 +1,28 @@
+from django.utils.functional import SimpleLazyObject
 from . import tools
 
 
-def is_professor(request):
-    return {"USER_IS_PROFESSOR": tools.is_professor(request)}
+def page_class(request):
+    """
+    Returns the class name in the url of request (see tools.className_from_url)
+    It is only parsed once per request, however many templates ask for it
+    """
+    if not hasattr(request, "page_class"):
+        request.page_class = tools.className_from_url(request)
+    return request.page_class
 
 
-def get_class_color(request):
-    return {"CLASS_COLOR": tools.get_color(request, tools.className_from_url(request))}
-
-
-def is_assigned_professor(request):
+def user_context(request):
+    """
+    Puts USER_IS_PROFESSOR, CLASS_COLOR and IS_ASSIGNED_PROFESSOR into every template
+    Each value is lazy, so it is only looked up if the template actually uses it
+    """
     return {
-        "IS_ASSIGNED_PROFESSOR": tools.is_professor_for_class(
-            request, tools.className_from_url(request)
-        )
+        "USER_IS_PROFESSOR": SimpleLazyObject(lambda: tools.is_professor(request)),
+        "CLASS_COLOR": SimpleLazyObject(
+            lambda: tools.get_color(request, page_class(request))
+        ),
+        "IS_ASSIGNED_PROFESSOR": SimpleLazyObject(
+            lambda: tools.is_professor_for_class(request, page_class(request))
+        ),
     }
@@ -1,39 +1,181 @@
 import os
 import smtplib
+import socket
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import threading
-from django.core.exceptions import AppRegistryNotReady
-import schedule
+from django.conf import settings
 import time
 
+# errors after which an smtp connection can not be used anymore
+# (gmail refuses the sender once it dropped the session of a connection that sat idle)
+# SMTPException is an OSError too, so OSError itself would also catch refused messages
+CONNECTION_ERRORS = (
+    smtplib.SMTPServerDisconnected,
+    smtplib.SMTPSenderRefused,
+    ConnectionError,
+    socket.timeout,
+)
+
+
+def refused(error):
+    """
+    Returns whether error is the server permanently refusing a message (a bad address, or a
+    5xx reply to it), so sending the same message again can never work
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    # a refused sender is our problem, not the message's
+    if isinstance(error, smtplib.SMTPSenderRefused):
+        return False
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class SMTPPool:
+    """
+    A small pool of logged in smtp connections, shared by every thread sending mail
+    A connection that sat idle for longer than keepalive seconds is probed with NOOP before it
+    is handed out again, and connections that turn out to be dead are replaced by new ones
+    """
+
+    def __init__(self, connect, size=4, keepalive=30):
+        # connect() returns a new logged in smtplib.SMTP
+        self.connect = connect
+        self.size = size
+        self.keepalive = keepalive
+        # (connection, idle since) of connections nobody is using right now
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        """
+        Returns a working connection, waiting for one if all size connections are in use
+        Give it back with release
+        """
+        self.slots.acquire()
+        try:
+            while True:
+                with self.lock:
+                    if len(self.idle) == 0:
+                        break
+                    connection, since = self.idle.pop()
+                if time.monotonic() - since < self.keepalive or self.alive(connection):
+                    return connection
+                self.discard(connection)
+            return self.connect()
+        except:
+            self.slots.release()
+            raise
+
+    def release(self, connection, broken=False):
+        """
+        Gives a connection back to the pool. Broken connections are closed instead of reused
+        """
+        if broken:
+            self.discard(connection)
+        else:
+            with self.lock:
+                self.idle.append((connection, time.monotonic()))
+        self.slots.release()
+
+    def alive(self, connection):
+        """
+        Returns whether the server still answers NOOP on connection
+        """
+        try:
+            return connection.noop()[0] == 250
+        except CONNECTION_ERRORS:
+            return False
+
+    def discard(self, connection):
+        """
+        Closes a connection, without caring whether the server is still there
+        """
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    def probe(self):
+        """
+        Sends NOOP on every idle connection that sat idle for longer than keepalive, so they are
+        kept open between sends, and drops the ones that died
+        """
+        with self.lock:
+            idle, self.idle = self.idle, []
+        now = time.monotonic()
+        for connection, since in idle:
+            if now - since < self.keepalive:
+                alive = True
+            else:
+                alive = self.alive(connection)
+                since = now
+            if alive:
+                with self.lock:
+                    self.idle.append((connection, since))
+            else:
+                self.discard(connection)
+
+    def close(self):
+        """
+        Closes every idle connection
+        """
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection, _ in idle:
+            self.discard(connection)
+
+
 # setup from https://towardsdatascience.com/e-mails-notification-bot-with-python-4efa227278fb
 class EmailService:
     def __init__(self):
         """
         Initializes the email service **only** if the device is running on a deployed server
+        Sending the queued notifications is a job of the daemon's scheduler (see services)
         """
+        self.pool = None
         self.login()
-        t = threading.Thread(target=self.setup_notification_cycle)
-        t.setDaemon(True)
-        t.start()
 
     def login(self):
+        """
+        (Re)creates the connection pool, and opens its first connection to fail early on bad credentials
+        The server is taken from settings.EMAIL_HOST/EMAIL_PORT, so a local stand-in
+        (python -m aiosmtpd -n -l localhost:8025) can be used instead of gmail
+        """
         print("Logging in to email server")
         self.sender_email = "a21assignmentorganizer@gmail.com"
         self.sender_username = "a21assignmentorganizer"
         self.sender_password = os.getenv("EMAIL_PASSWORD")
-        self.smtp_server = "smtp.gmail.com"
-        self.smtp_port = 587
+        self.smtp_server = getattr(settings, "EMAIL_HOST", "smtp.gmail.com")
+        self.smtp_port = getattr(settings, "EMAIL_PORT", 587)
+        self.use_tls = getattr(settings, "EMAIL_USE_TLS", True)
 
-        self.server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-        self.server.starttls()
-        self.server.login(self.sender_username, self.sender_password)
+        if self.pool != None:
+            self.pool.close()
+        self.pool = SMTPPool(
+            self.connect,
+            size=getattr(settings, "EMAIL_POOL_SIZE", 4),
+            keepalive=getattr(settings, "EMAIL_KEEPALIVE", 30),
+        )
+        self.pool.release(self.pool.acquire())
         print("Logged into email server")
 
+    def connect(self):
+        """
+        Opens a new logged in connection to the smtp server
+        """
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=30)
+        if self.use_tls:
+            server.starttls()
+        if self.sender_password != None:
+            server.login(self.sender_username, self.sender_password)
+        return server
+
     def message(self, text, to, subject):
         """
         Sends a message with body=text to recipient=to with subject=subject
+        Safe to call from several threads at once, each send gets its own pooled connection
         """
         print("Sending email...")
         message = MIMEMultipart("alternative")
@@ -44,57 +186,20 @@ class EmailService:
 
         text = message.as_string()
 
-        self.server.sendmail(self.sender_email, to, text)
-        print("Mail sent!")
-
-    def setup_notification_cycle(self):
-        """
-        Initializes the scheduler for the notification cycle
-        """
-        try:
-            from . import tools
-
-            # every day at 1AM update daily assignments and queue messages to be sent
-            schedule.every().day.at("01:00:00").do(
-                tools.notify_students_of_today_assignments
-            )
-
-            # every 10 minutes check for a class assignment change and send messages out
-            schedule.every(10).minutes.do(tools.send_all_messages)
-
-            self.notification_cycle()
-        except AppRegistryNotReady:
-            print(
-                "A NON-FATAL error occurred with the email notification cycle, waiting 10 seconds and trying again"
-            )
-            time.sleep(10)
-            self.setup_notification_cycle()
-
-    def notification_cycle(self):
-        """
-        Sends all notifications in notification models every once and a while
-        """
-        print("Email notification loop has begun")
-        try:
-            while True:
-                schedule.run_pending()
-                time.sleep(10)
-        except smtplib.SMTPSenderRefused:
-            print(
-                "A timeout error occured while attempting to send a message, logging in and trying again"
-            )
-            time.sleep(5)
-            self.login()
-            time.sleep(5)
-            self.notification_cycle()
-        except:
-            import traceback
-
-            traceback.print_exc()
-            print("A FATAL EXCEPTION OCCURED IN EMAIL NOTIFICATION CYCLE")
-            print("Waiting 30 seconds and trying again")
-            time.sleep(30)
-            self.login()
-            time.sleep(5)
-            self.notification_cycle()
-
+        # a pooled connection might have died since it was checked, so retry once on a new one
+        for attempt in range(2):
+            connection = self.pool.acquire()
+            try:
+                connection.sendmail(self.sender_email, to, text)
+            except CONNECTION_ERRORS:
+                self.pool.release(connection, broken=True)
+                if attempt == 1:
+                    raise
+                continue
+            except:
+                # the server refused this message, but the connection is fine
+                self.pool.release(connection)
+                raise
+            self.pool.release(connection)
+            print("Mail sent!")
+            return
@@ -0,0 +1,52 @@
+from .tiered_cache import TieredCache
+
+
+class EventCache(TieredCache):
+    """
+    Caches google calendar event listings per calendarId, so a page load does not
+    have to ask google for every calendar every single time.
+    Entries are keyed by (calendarId, version, window), where version is bumped in the shared
+    tier on every write to the calendar, so stale entries in other processes are ignored
+    """
+
+    prefix = "event_cache"
+
+    def version(self, calendarId):
+        """
+        Returns the current version of a calendar in the shared tier (0 if there is no shared tier)
+        """
+        shared = self.shared()
+        if shared == None:
+            return 0
+        return shared.get(f"event_cache_version:{calendarId}", 0)
+
+    def get(self, calendarId, window=None):
+        """
+        Returns a copy of the cached events for calendarId and window, or None if they are not cached
+        """
+        if self.ttl <= 0:
+            return None
+
+        items = super().get((calendarId, self.version(calendarId), window))
+        if items == None:
+            return None
+        return [dict(event) for event in items]
+
+    def set(self, calendarId, items, window=None):
+        """
+        Caches a list of events for calendarId and window
+        """
+        if self.ttl <= 0:
+            return
+
+        super().set(
+            (calendarId, self.version(calendarId), window),
+            [dict(event) for event in items],
+        )
+
+    def invalidate(self, calendarId):
+        """
+        Drops everything cached for calendarId. Called whenever we write to a calendar
+        """
+        self.drop(lambda key: key[0] == calendarId)
+        self.increment(f"event_cache_version:{calendarId}")
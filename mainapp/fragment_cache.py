@@ -0,0 +1,43 @@
+import hashlib
+from .tiered_cache import TieredCache
+
+
+class FragmentCache(TieredCache):
+    """
+    Caches rendered HTML (calendar months, todo lists), so a repeat view is a cache fetch.
+    Fragments are never invalidated directly. Instead their keys contain version stamps
+    (see stamps), and bumping a stamp on every write makes the old fragments unreachable.
+    """
+
+    prefix = "fragment"
+
+    def __init__(self, ttl=300, max_entries=1024, backend=None):
+        super().__init__(ttl, max_entries, backend)
+        # stamp name -> version, only used without a shared tier
+        self.versions = {}
+
+    def stamps(self, *names):
+        """
+        Returns the current versions of the stamps with the given names (0 if never bumped)
+        Names are things a fragment is rendered from, like "calendar:<calendarId>"
+        """
+        shared = self.shared()
+        if shared == None:
+            with self.lock:
+                return [self.versions.get(name, 0) for name in names]
+        found = shared.get_many([f"fragment_stamp:{name}" for name in names])
+        return [found.get(f"fragment_stamp:{name}", 0) for name in names]
+
+    def bump(self, name):
+        """
+        Moves a stamp to a new version, so every fragment rendered from it is rendered again
+        """
+        with self.lock:
+            self.versions[name] = self.versions.get(name, 0) + 1
+        self.increment(f"fragment_stamp:{name}")
+
+    def key(self, *parts):
+        """
+        Returns a cache key for a fragment rendered from parts (anything with a stable repr)
+        """
+        return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
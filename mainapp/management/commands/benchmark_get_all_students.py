@@ -0,0 +1,98 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from mainapp import models, tools
+
+# this command times tools.get_all_students against a scan of every student, on synthetic data
+class Command(BaseCommand):
+
+    help = "Benchmarks tools.get_all_students on synthetic students (rolled back afterwards)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=100000)
+        parser.add_argument("--classes", type=int, default=200)
+        parser.add_argument("--classes-per-student", type=int, default=5)
+
+    def handle(self, *args, **options):
+        '''
+        Creates synthetic students and enrollments inside a transaction, times both lookups,
+        and rolls everything back so the database is left as it was
+        '''
+        students = options["students"]
+        class_count = options["classes"]
+        per_student = min(options["classes_per_student"], class_count)
+
+        class Rollback(Exception):
+            pass
+
+        try:
+            with transaction.atomic():
+                models.Class.objects.bulk_create(
+                    [
+                        models.Class(
+                            className=f"benchmark class {i}",
+                            calendarId="",
+                            professorId=0,
+                            description="",
+                        )
+                        for i in range(class_count)
+                    ]
+                )
+                # bulk_create does not return ids on every database
+                classes = list(
+                    models.Class.objects.filter(
+                        className__startswith="benchmark class "
+                    ).order_by("id")
+                )
+                models.Student.objects.bulk_create(
+                    [
+                        models.Student(userId=-1 - i, calendarId="")
+                        for i in range(students)
+                    ],
+                    batch_size=5000,
+                )
+                student_ids = models.Student.objects.filter(userId__lt=0).values_list(
+                    "id", flat=True
+                )
+                models.Enrollment.objects.bulk_create(
+                    [
+                        models.Enrollment(
+                            student_id=student_id,
+                            clazz_id=classes[(i + j) % class_count].id,
+                        )
+                        for i, student_id in enumerate(student_ids.iterator())
+                        for j in range(per_student)
+                    ],
+                    batch_size=5000,
+                )
+                className = classes[0].className
+
+                start = time.perf_counter()
+                indexed = tools.get_all_students(className)
+                indexed_time = time.perf_counter() - start
+
+                # what get_all_students used to do: look at every single student
+                # (without unpickling anything, so the old code was slower still)
+                start = time.perf_counter()
+                enrolled = set(
+                    models.Enrollment.objects.filter(clazz=classes[0]).values_list(
+                        "student_id", flat=True
+                    )
+                )
+                scanned = [
+                    student
+                    for student in models.Student.objects.all().iterator()
+                    if student.id in enrolled
+                ]
+                scan_time = time.perf_counter() - start
+
+                print(
+                    f"{students} students, {len(indexed)} enrolled in '{className}'\n"
+                    f"indexed lookup: {indexed_time * 1000:.1f} ms\n"
+                    f"full scan:      {scan_time * 1000:.1f} ms"
+                )
+                if len(scanned) != len(indexed):
+                    print("WARNING: lookups disagree")
+                raise Rollback
+        except Rollback:
+            pass
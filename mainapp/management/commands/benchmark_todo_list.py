@@ -0,0 +1,92 @@
+import datetime
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from mainapp import models, tools
+from mainapp.middleware import IdentityMap, current_identity_map
+
+# this command times tools.render_todo_list on synthetic events, for a few list sizes
+class Command(BaseCommand):
+
+    help = "Benchmarks rendering of the todo list on synthetic events (rolled back afterwards)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+        parser.add_argument("--classes", type=int, default=5)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        '''
+        Creates a synthetic student enrolled in a few classes inside a transaction, renders
+        todo lists of every size, and rolls everything back so the database is left as it was
+        '''
+        class_count = max(options["classes"], 1)
+        repeat = max(options["repeat"], 1)
+
+        class Rollback(Exception):
+            pass
+
+        try:
+            with transaction.atomic():
+                user = User.objects.create(username="benchmark todo user")
+                classes = [
+                    models.Class.objects.create(
+                        className=f"benchmark class {i}",
+                        calendarId="",
+                        professorId=user.id if i % 2 == 0 else 0,
+                        description="",
+                    )
+                    for i in range(class_count)
+                ]
+                models.Student.objects.create(
+                    userId=user.id,
+                    calendarId="",
+                    classes=set(classes),
+                    class_colors={clazz: "#123456" for clazz in classes},
+                )
+                request = RequestFactory().get("/")
+                request.user = user
+
+                now = datetime.datetime.now(datetime.timezone.utc)
+                for size in options["sizes"]:
+                    events = []
+                    for i in range(size):
+                        end = now + datetime.timedelta(days=i % 30, hours=1)
+                        events.append(
+                            {
+                                "summary": f"assignment {i}",
+                                "id": str(i),
+                                "start": {"dateTime": end.isoformat()},
+                                "end": {"dateTime": end.isoformat()},
+                                # every few events is a personal one
+                                "className": None
+                                if i % (class_count + 1) == class_count
+                                else classes[i % (class_count + 1)].className,
+                            }
+                        )
+
+                    elapsed = 0
+                    for _ in range(repeat):
+                        # a fresh identity map per render, like IdentityMapMiddleware gives each request
+                        request.identity_map = IdentityMap(user.id)
+                        token = current_identity_map.set(request.identity_map)
+                        try:
+                            with CaptureQueriesContext(connection) as queries:
+                                start = time.perf_counter()
+                                tools.render_todo_list(
+                                    request, events, editable=True, todo_loc=True
+                                )
+                                elapsed += time.perf_counter() - start
+                        finally:
+                            current_identity_map.reset(token)
+
+                    print(
+                        f"{size:>6} events: {elapsed / repeat * 1000:8.2f} ms per render, "
+                        f"{len(queries)} queries"
+                    )
+                raise Rollback
+        except Rollback:
+            pass
@@ -1,16 +1,44 @@
-from mainapp import services
+import traceback
+from django.conf import settings
+from django.db import close_old_connections
+from mainapp import services, tools
 from django_daemon_command.management.base import DaemonCommand
 
-# this class initializes the email service alone for a separate daemon
+# this class initializes the email service alone for a separate daemon, and runs the periodic jobs
 class Command(DaemonCommand):
 
     initialized = False
     def process(self, *args, **options):
         '''
-        Initializes email service for Heroku Daemon
+        Initializes email service for Heroku Daemon, then runs the jobs that are due and
+        sends notifications as they are queued
         '''
         if not self.initialized:
             print("Initializing dyno services...")
             services.initialize_services_for_daemon()
             print("Services initialized")
-            self.initialized = True
\ No newline at end of file
+            self.initialized = True
+
+        # the daemon lives for days, do not hold on to connections the database dropped
+        close_old_connections()
+        try:
+            services.scheduler.run_pending()
+        except Exception:
+            # jobs handle their own errors, this is the scheduler itself (e.g. the database
+            # is away), so just try again next time
+            traceback.print_exc()
+        finally:
+            close_old_connections()
+
+        # sleep until notifications are queued (or it is time to check the jobs again),
+        # and send them right away
+        if services.notification_listener.wait(
+            getattr(settings, "SCHEDULER_POLL_INTERVAL", 10)
+        ):
+            try:
+                tools.send_all_messages()
+            except Exception:
+                # whatever was not sent stays queued for the next wakeup or sweep
+                traceback.print_exc()
+            finally:
+                close_old_connections()
@@ -0,0 +1,101 @@
+import logging
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connection
+from . import models, services
+
+logger = logging.getLogger(__name__)
+
+# identity map of the request currently being handled, for helpers that are not given the request
+current_identity_map = ContextVar("current_identity_map", default=None)
+
+
+class IdentityMap:
+    """
+    Request scoped cache of the Student and Class rows used while handling one request
+    Every row is loaded at most once, and every tools.* helper gets the same instance back,
+    so changes made through one helper are seen by the rest. Missing rows are not remembered,
+    since they might be created later on in the request
+    """
+
+    def __init__(self, userId):
+        self.userId = userId
+        self.loaded_student = None
+        self.classes = {}
+        # set of checked off (className, eventId) pairs, see tools.get_checked_off
+        self.checked_off = None
+
+    def student(self):
+        """
+        Returns the Student for the user of this request, or None if there is none
+        """
+        if self.loaded_student == None and self.userId != None:
+            self.loaded_student = models.Student.objects.filter(
+                userId=self.userId
+            ).first()
+        return self.loaded_student
+
+    def clazz(self, className):
+        """
+        Returns the Class with class name className, or None if there is none
+        """
+        if className not in self.classes:
+            clazz = models.Class.objects.filter(className=className).first()
+            if clazz == None:
+                return None
+            self.classes[className] = clazz
+        return self.classes[className]
+
+
+class IdentityMapMiddleware:
+    """
+    Attaches an IdentityMap to every request (request.identity_map), and counts the
+    database queries made while handling it (request.query_count)
+    With DEBUG on, the count is also sent back in the X-Query-Count header, along with
+    the hit ratios of this worker's event and fragment caches
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.identity_map = IdentityMap(request.user.id)
+        request.query_count = 0
+
+        def count_query(execute, sql, params, many, context):
+            request.query_count += 1
+            return execute(sql, params, many, context)
+
+        token = current_identity_map.set(request.identity_map)
+        try:
+            with connection.execute_wrapper(count_query):
+                response = self.get_response(request)
+        finally:
+            current_identity_map.reset(token)
+
+        logger.debug(f"{request.path} made {request.query_count} queries")
+        if settings.DEBUG:
+            response["X-Query-Count"] = str(request.query_count)
+            event_cache = services.event_cache.stats()
+            fragment_cache = services.fragment_cache.stats()
+            response["X-Event-Cache-Hit-Ratio"] = f"{event_cache['hit_ratio']:.2f}"
+            response["X-Fragment-Cache-Hit-Ratio"] = f"{fragment_cache['hit_ratio']:.2f}"
+        return response
+
+
+class StudentMiddleware:
+    """
+    Creates the Student of a logged in user the first time they show up, so views do not
+    have to provision anything before using it. Must come after IdentityMapMiddleware
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # tools imports this module, so it can only be imported once both are loaded
+        from . import tools
+
+        if request.user.is_authenticated and request.identity_map.student() == None:
+            tools.initialize_user(request)
+        return self.get_response(request)
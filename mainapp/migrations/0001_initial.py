@@ -0,0 +1,66 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:03
+
+from django.db import migrations, models
+import picklefield.fields
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckedAssignments',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('userId', models.IntegerField()),
+                ('className', models.CharField(max_length=50)),
+                ('eventId', models.CharField(max_length=200)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Class',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('className', models.CharField(max_length=50)),
+                ('calendarId', models.CharField(max_length=200)),
+                ('professorId', models.IntegerField()),
+                ('description', models.CharField(max_length=200)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='File',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('className', models.CharField(blank=True, max_length=255)),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('author', models.CharField(blank=True, max_length=255)),
+                ('pdf', models.FileField(upload_to='files/pdfs/')),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.CharField(max_length=50)),
+                ('text', models.CharField(max_length=500)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Student',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('userId', models.IntegerField()),
+                ('calendarId', models.CharField(max_length=200)),
+                ('classes', picklefield.fields.PickledObjectField(editable=False)),
+                ('class_colors', picklefield.fields.PickledObjectField(editable=False)),
+                ('color', models.CharField(default='#0052bd', max_length=10)),
+                ('professor', models.BooleanField(default=False)),
+                ('name', models.CharField(max_length=50, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,134 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+import picklefield.fields
+
+
+def copy_enrollments(apps, schema_editor):
+    """
+    Creates an Enrollment for every class in a student's pickled class set, then clears the pickles
+    """
+    Class = apps.get_model('mainapp', 'Class')
+    Student = apps.get_model('mainapp', 'Student')
+    Enrollment = apps.get_model('mainapp', 'Enrollment')
+
+    class_ids = set(Class.objects.values_list('id', flat=True))
+    migrated = 0
+    for student in Student.objects.filter(legacy_classes__isnull=False).iterator():
+        # the pickles hold Class instances and a Class -> color dict, only their pks are used
+        colors = {
+            clazz.pk: color
+            for clazz, color in (student.legacy_class_colors or dict()).items()
+            if clazz != None
+        }
+        Enrollment.objects.bulk_create(
+            [
+                Enrollment(
+                    student_id=student.pk,
+                    clazz_id=clazz.pk,
+                    color=colors.get(clazz.pk, '#0052bd'),
+                )
+                # classes deleted since they were pickled are dropped
+                for clazz in student.legacy_classes
+                if clazz != None and clazz.pk in class_ids
+            ],
+            ignore_conflicts=True,
+        )
+        student.legacy_classes = None
+        student.legacy_class_colors = None
+        student.save(update_fields=['legacy_classes', 'legacy_class_colors'])
+        migrated += 1
+    print(f'Migrated enrollments of {migrated} students')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendarId', models.CharField(max_length=200)),
+                ('eventId', models.CharField(max_length=200)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('data', models.JSONField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CalendarSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendarId', models.CharField(max_length=200, unique=True)),
+                ('syncToken', models.CharField(blank=True, max_length=500)),
+                ('synced_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        # the pickled fields are renamed in the model only, their columns stay (and keep their
+        # data) until copy_enrollments below has moved it into Enrollment
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.AlterField(
+                    model_name='student',
+                    name='classes',
+                    field=picklefield.fields.PickledObjectField(editable=False, null=True),
+                ),
+                migrations.AlterField(
+                    model_name='student',
+                    name='class_colors',
+                    field=picklefield.fields.PickledObjectField(editable=False, null=True),
+                ),
+            ],
+            state_operations=[
+                migrations.RemoveField(
+                    model_name='student',
+                    name='class_colors',
+                ),
+                migrations.RemoveField(
+                    model_name='student',
+                    name='classes',
+                ),
+                migrations.AddField(
+                    model_name='student',
+                    name='legacy_class_colors',
+                    field=picklefield.fields.PickledObjectField(db_column='class_colors', editable=False, null=True),
+                ),
+                migrations.AddField(
+                    model_name='student',
+                    name='legacy_classes',
+                    field=picklefield.fields.PickledObjectField(db_column='classes', editable=False, null=True),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Enrollment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('color', models.CharField(default='#0052bd', max_length=10)),
+                ('clazz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='enrollments', to='mainapp.class')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='enrollments', to='mainapp.student')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='calendarevent',
+            index=models.Index(fields=['calendarId', 'start'], name='mainapp_cal_calenda_db24c4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='calendarevent',
+            index=models.Index(fields=['calendarId', 'end'], name='mainapp_cal_calenda_3e23b0_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='calendarevent',
+            constraint=models.UniqueConstraint(fields=('calendarId', 'eventId'), name='unique_calendar_event'),
+        ),
+        migrations.AddConstraint(
+            model_name='enrollment',
+            constraint=models.UniqueConstraint(fields=('student', 'clazz'), name='unique_enrollment'),
+        ),
+        migrations.RunPython(copy_enrollments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0002_enrollments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('next_run_at', models.DateTimeField()),
+                ('failures', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('runs', models.IntegerField(default=0)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+                ('last_duration', models.FloatField(blank=True, null=True)),
+                ('max_duration', models.FloatField(default=0)),
+                ('total_duration', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SchedulerLock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('owner', models.CharField(max_length=100)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='change',
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='claim',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='name',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='calendar_claimed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='calendar_pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='digest_sent_on',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='timezone',
+            field=models.CharField(default='America/New_York', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='class',
+            name='className',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='className',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='student',
+            name='userId',
+            field=models.IntegerField(unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['clazz', 'student'], name='mainapp_enr_clazz_i_7772b2_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='checkedassignments',
+            constraint=models.UniqueConstraint(fields=('userId', 'className', 'eventId'), name='unique_checked_assignment'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0003_scheduler_and_claims'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='text',
+            field=models.TextField(),
+        ),
+    ]
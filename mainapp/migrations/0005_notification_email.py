@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0004_notification_text'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='email',
+            field=models.CharField(max_length=254),
+        ),
+    ]
@@ -11,14 +11,104 @@ class Student(models.Model):
     Professors are also counted as students, so they also get their own calendar
     """
 
-    userId = models.IntegerField()
+    userId = models.IntegerField(unique=True)
     calendarId = models.CharField(max_length=200)
-    # pickled representation of python set of classNames
-    classes = PickledObjectField()
-    class_colors = PickledObjectField()
     color = models.CharField(default="#0052bd", max_length=10)
     professor = models.BooleanField(default=False)
     name = models.CharField(max_length=50, null=True)
+    # set while the calendar of this student is being created in the background
+    # (see tools.create_calendar), calendarId stays "" until it is done
+    calendar_pending = models.BooleanField(default=False)
+    # when a worker claimed the creation of the calendar, so two workers do not create it at once
+    calendar_claimed = models.DateTimeField(null=True, blank=True)
+    # the daily digest is sent in this time zone (see tools.notify_students_of_today_assignments)
+    timezone = models.CharField(default="America/New_York", max_length=64)
+    # local date of the last daily digest queued for this student, so it is only sent once a day
+    digest_sent_on = models.DateField(null=True, blank=True)
+    # pickled sets of classes and colors from before Enrollment existed
+    # only read by migration 0002_enrollments, which moves them into Enrollment rows
+    legacy_classes = PickledObjectField(db_column="classes", null=True, editable=False)
+    legacy_class_colors = PickledObjectField(
+        db_column="class_colors", null=True, editable=False
+    )
+
+    def load_enrollments(self):
+        """
+        Loads the classes and colors of this student from Enrollment in a single query
+        """
+        self._classes = set()
+        self._class_colors = dict()
+        if self.pk != None:
+            for enrollment in self.enrollments.select_related("clazz"):
+                self._classes.add(enrollment.clazz)
+                self._class_colors[enrollment.clazz] = enrollment.color
+
+    def forget_enrollments(self):
+        """
+        Drops loaded classes and colors, so they are loaded again on next use
+        """
+        self.__dict__.pop("_classes", None)
+        self.__dict__.pop("_class_colors", None)
+
+    @property
+    def classes(self):
+        """
+        Set of the classes this student is enrolled in. Change it with tools.add_class/remove_class
+        """
+        if "_classes" not in self.__dict__:
+            self.load_enrollments()
+        return frozenset(self._classes)
+
+    @classes.setter
+    def classes(self, classes):
+        # enrollments are replaced with these classes on the next save
+        self._pending_classes = set(classes)
+        self._classes = set(classes)
+        self._class_colors = {
+            clazz: self.__dict__.get("_pending_class_colors", {}).get(clazz, "#0052bd")
+            for clazz in classes
+        }
+
+    @property
+    def class_colors(self):
+        """
+        Dictionary of class -> color picked for it. Change it with tools.set_class_color
+        """
+        if "_class_colors" not in self.__dict__:
+            self.load_enrollments()
+        return dict(self._class_colors)
+
+    @class_colors.setter
+    def class_colors(self, class_colors):
+        # colors of enrolled classes are updated on the next save
+        self._pending_class_colors = dict(class_colors)
+        if "_classes" in self.__dict__:
+            for clazz in self._classes:
+                if clazz in class_colors:
+                    self._class_colors[clazz] = class_colors[clazz]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        pending_classes = self.__dict__.pop("_pending_classes", None)
+        pending_colors = self.__dict__.pop("_pending_class_colors", {})
+        if pending_classes != None:
+            self.enrollments.exclude(clazz__in=pending_classes).delete()
+            enrolled = set(self.enrollments.values_list("clazz_id", flat=True))
+            Enrollment.objects.bulk_create(
+                [
+                    Enrollment(
+                        student=self,
+                        clazz=clazz,
+                        color=pending_colors.get(clazz, "#0052bd"),
+                    )
+                    for clazz in pending_classes
+                    if clazz.pk not in enrolled
+                ]
+            )
+        for clazz, color in pending_colors.items():
+            self.enrollments.filter(clazz=clazz).update(color=color)
+        if pending_classes != None or len(pending_colors) != 0:
+            self.forget_enrollments()
 
 
 class Class(models.Model):
@@ -28,7 +118,7 @@ class Class(models.Model):
     Students can add classes to their calendars through a page
     """
 
-    className = models.CharField(max_length=50)
+    className = models.CharField(max_length=50, unique=True)
     calendarId = models.CharField(max_length=200)
     professorId = models.IntegerField()
     description = models.CharField(max_length=200)
@@ -37,8 +127,31 @@ class Class(models.Model):
         return self.className
 
 
+class Enrollment(models.Model):
+    """
+    A student enrolled in a class, and the color they picked for it
+    Replaces the pickled Student.classes and Student.class_colors, so "classes of a student"
+    and "students in a class" are each a single indexed query
+    """
+
+    student = models.ForeignKey(
+        Student, on_delete=models.CASCADE, related_name="enrollments"
+    )
+    clazz = models.ForeignKey(Class, on_delete=models.CASCADE, related_name="enrollments")
+    color = models.CharField(default="#0052bd", max_length=10)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["student", "clazz"], name="unique_enrollment"
+            )
+        ]
+        # reverse index: the students of a class are read straight off this index
+        indexes = [models.Index(fields=["clazz", "student"])]
+
+
 class File(models.Model):
-    className = models.CharField(max_length=255, blank=True)
+    className = models.CharField(max_length=255, blank=True, db_index=True)
 
     title = models.CharField(max_length=255, blank=True)
     author = models.CharField(max_length=255, blank=True)
@@ -67,8 +180,17 @@ class Notification(models.Model):
     Notification model. Stores the userId, and body for emails to send to a user. Notifications are cleared periodically by the periodic message sender. 
     """
 
-    email = models.CharField(max_length=50)
-    text = models.CharField(max_length=500)
+    # as long as User.email can be
+    email = models.CharField(max_length=254)
+    # a daily digest lists every assignment due, so the text has no useful upper bound
+    text = models.TextField()
+    # for change notifications, the recipient's name and the line about the change, so several
+    # changes for one recipient can be sent as one email (see tools.coalesce_notifications)
+    name = models.CharField(max_length=50, null=True, blank=True)
+    change = models.CharField(max_length=500, null=True, blank=True)
+    # token of the worker sending this notification right now, see tools.claim_notifications
+    claim = models.CharField(max_length=32, null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
 
 
 class CheckedAssignments(models.Model):
@@ -79,3 +201,75 @@ class CheckedAssignments(models.Model):
     userId = models.IntegerField()
     className = models.CharField(max_length=50)
     eventId = models.CharField(max_length=200)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["userId", "className", "eventId"], name="unique_checked_assignment"
+            )
+        ]
+
+
+class CalendarEvent(models.Model):
+    """
+    Local copy of an event in a google calendar. Kept up to date by calendar_sync, so reads
+    are database queries instead of api calls. data is the event exactly as the api returned it
+    """
+
+    calendarId = models.CharField(max_length=200)
+    eventId = models.CharField(max_length=200)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    data = models.JSONField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["calendarId", "start"]),
+            models.Index(fields=["calendarId", "end"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["calendarId", "eventId"], name="unique_calendar_event"
+            )
+        ]
+
+
+class CalendarSyncState(models.Model):
+    """
+    Maintains the google syncToken for each calendar in the local event store,
+    and when it was last synced
+    """
+
+    calendarId = models.CharField(max_length=200, unique=True)
+    syncToken = models.CharField(max_length=500, blank=True)
+    synced_at = models.DateTimeField(null=True)
+
+
+class ScheduledJob(models.Model):
+    """
+    A periodic background job and when it runs next, so runs missed while no worker was up
+    are caught up on. Also keeps run counts and durations (see scheduler.Scheduler)
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    next_run_at = models.DateTimeField()
+    # failed runs in a row, reset once the job succeeds (or is given up on until next time)
+    failures = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    runs = models.IntegerField(default=0)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    # durations are in seconds
+    last_duration = models.FloatField(null=True, blank=True)
+    max_duration = models.FloatField(default=0)
+    total_duration = models.FloatField(default=0)
+
+
+class SchedulerLock(models.Model):
+    """
+    Leader lock of the scheduler: only the worker named owner runs periodic jobs,
+    until it stops renewing the lock and it expires
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    owner = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()
@@ -0,0 +1,170 @@
+import datetime
+import os
+import socket
+import time
+import traceback
+import uuid
+import pytz
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from . import models
+
+
+class Scheduler:
+    """
+    Runs periodic jobs from the daemon worker, with their schedule kept in the database
+    (models.ScheduledJob), so a restart does not lose runs: a job that was due while no worker
+    was up runs as soon as one is back (once, however many runs were missed).
+    A failed run is retried up to max_retries times, waiting backoff seconds and doubling,
+    before the job waits for its next regular run.
+    Only the worker holding the leader lock (models.SchedulerLock) runs jobs, so any number of
+    workers can call run_pending. The lock expires lease seconds after it was last renewed,
+    so lease has to be longer than the longest job.
+    """
+
+    def __init__(self, lease=60, max_retries=3, backoff=30, name="scheduler"):
+        self.lease = lease
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.name = name
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # job name -> (interval in seconds, function)
+        self.jobs = {}
+
+    def every(self, seconds, name, function):
+        """
+        Registers function (no arguments) to run every seconds seconds under name
+        Jobs seen for the first time run on the next call of run_pending
+        """
+        self.jobs[name] = (seconds, function)
+        return self
+
+    def lead(self, now):
+        """
+        Takes or renews the leader lock, returns whether this worker holds it
+        """
+        expires_at = now + datetime.timedelta(seconds=self.lease)
+        taken = (
+            models.SchedulerLock.objects.filter(name=self.name)
+            .filter(Q(owner=self.owner) | Q(expires_at__lt=now))
+            .update(owner=self.owner, expires_at=expires_at)
+        )
+        if taken != 0:
+            return True
+        try:
+            with transaction.atomic():
+                models.SchedulerLock.objects.create(
+                    name=self.name, owner=self.owner, expires_at=expires_at
+                )
+            return True
+        except IntegrityError:
+            # someone else holds it
+            return False
+
+    def resign(self):
+        """
+        Gives up the leader lock, so another worker can take over right away
+        """
+        models.SchedulerLock.objects.filter(name=self.name, owner=self.owner).delete()
+
+    def run_pending(self, now=None):
+        """
+        Runs every job that is due, if this worker is the leader
+        Returns the names of the jobs that were run
+        """
+        if now == None:
+            now = datetime.datetime.now(tz=pytz.utc)
+        if not self.lead(now):
+            return []
+
+        known = set(
+            models.ScheduledJob.objects.filter(name__in=self.jobs).values_list(
+                "name", flat=True
+            )
+        )
+        models.ScheduledJob.objects.bulk_create(
+            [
+                models.ScheduledJob(name=name, next_run_at=now)
+                for name in self.jobs
+                if name not in known
+            ],
+            ignore_conflicts=True,
+        )
+
+        ran = []
+        for job in models.ScheduledJob.objects.filter(
+            name__in=self.jobs, next_run_at__lte=now
+        ).order_by("next_run_at"):
+            # a long job before this one could have used up most of the lease
+            if not self.lead(datetime.datetime.now(tz=pytz.utc)):
+                break
+            self.run(job, now)
+            ran.append(job.name)
+        return ran
+
+    def run(self, job, now):
+        """
+        Runs a job once, then records how it went and when it runs next
+        """
+        interval, function = self.jobs[job.name]
+        print(f"Running job {job.name}")
+        started = time.monotonic()
+        try:
+            function()
+            error = None
+        except Exception:
+            error = traceback.format_exc()
+        duration = time.monotonic() - started
+
+        job.runs += 1
+        job.last_run_at = now
+        job.last_duration = duration
+        job.max_duration = max(job.max_duration, duration)
+        job.total_duration += duration
+
+        if error == None:
+            print(f"Job {job.name} finished in {duration:.2f}s")
+            job.failures = 0
+            job.last_error = ""
+            job.next_run_at = self.next_run(job.next_run_at, interval, now)
+        else:
+            print(error)
+            job.failures += 1
+            job.last_error = error
+            if job.failures <= self.max_retries:
+                delay = self.backoff * 2 ** (job.failures - 1)
+                print(f"Job {job.name} failed, retrying in {delay}s")
+                job.next_run_at = now + datetime.timedelta(seconds=delay)
+            else:
+                print(f"Job {job.name} failed {job.failures} times, skipping this run")
+                job.failures = 0
+                job.next_run_at = self.next_run(job.next_run_at, interval, now)
+        job.save()
+
+    def next_run(self, last, interval, now):
+        """
+        Returns when a job that was due at last runs next. Runs missed since are not all made
+        up for, the job just runs one interval from now
+        """
+        next_run_at = last + datetime.timedelta(seconds=interval)
+        if next_run_at <= now:
+            next_run_at = now + datetime.timedelta(seconds=interval)
+        return next_run_at
+
+    def stats(self):
+        """
+        Returns run counts and durations of every registered job
+        """
+        return {
+            job.name: {
+                "runs": job.runs,
+                "failures": job.failures,
+                "last_run_at": job.last_run_at,
+                "next_run_at": job.next_run_at,
+                "last_duration": job.last_duration,
+                "max_duration": job.max_duration,
+                "mean_duration": 0 if job.runs == 0 else job.total_duration / job.runs,
+                "last_error": job.last_error,
+            }
+            for job in models.ScheduledJob.objects.filter(name__in=self.jobs)
+        }
@@ -1,8 +1,14 @@
 import os
 from google.oauth2 import service_account
 import sys
+import threading
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+from django.conf import settings
 from .email_service import EmailService
+from .event_cache import EventCache
+from .fragment_cache import FragmentCache
 
 # structure of this method was replicated from https://cloud.google.com/iam/docs/creating-managing-service-accounts
 def initialize_google_calendar_service():
@@ -10,6 +16,7 @@ def initialize_google_calendar_service():
     Initializes the google calendar service
     Requires the placement of client_secret.json in the root directory of project
     """
+    global credentials
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "client_secret.json"
 
     credentials = service_account.Credentials.from_service_account_file(
@@ -20,6 +27,28 @@ def initialize_google_calendar_service():
     return build("calendar", "v3", credentials=credentials)
 
 
+# httplib2 is not thread safe, so every thread fetching from the api gets its own connection
+credentials = None
+thread_local = threading.local()
+
+
+def thread_http():
+    """
+    Returns an authorized http object for the current thread, to be passed to .execute(http=...)
+    Returns None when the api is faked, so the service default is used
+    """
+    if credentials == None:
+        return None
+    if not hasattr(thread_local, "http"):
+        thread_local.http = AuthorizedHttp(
+            credentials,
+            http=httplib2.Http(
+                timeout=getattr(settings, "CALENDAR_FETCH_TIMEOUT", 10)
+            ),
+        )
+    return thread_local.http
+
+
 def initialize_email_service():
     """
     Initializes the email service
@@ -45,18 +74,53 @@ class FakeCalendarService:
         return None
 
 
+def initialize_event_cache():
+    """
+    Initializes the cache in front of calendar event listings
+    It stays off without a shared backend: a write invalidates the calendar only in the
+    worker that made it, so the others would keep serving the old events
+    """
+    backend = getattr(settings, "EVENT_CACHE_BACKEND", None)
+    return EventCache(
+        ttl=0 if backend == None else getattr(settings, "EVENT_CACHE_TTL", 300),
+        max_entries=getattr(settings, "EVENT_CACHE_MAX_ENTRIES", 512),
+        backend=backend,
+    )
+
+
+def initialize_fragment_cache():
+    """
+    Initializes the cache of rendered calendar months and todo lists
+    It stays off without a shared backend: stamps bumped by one worker would not reach the
+    others, which would keep serving fragments from before a check off or color change
+    """
+    backend = getattr(settings, "FRAGMENT_CACHE_BACKEND", None)
+    return FragmentCache(
+        ttl=0 if backend == None else getattr(settings, "FRAGMENT_CACHE_TTL", 300),
+        max_entries=getattr(settings, "FRAGMENT_CACHE_MAX_ENTRIES", 1024),
+        backend=backend,
+    )
+
+
 def initialize_services():
     """
     Initializes all services into service library
     """
     global calendar_service
     global email_service
+    global event_cache
+    global fragment_cache
     if "test" in str(sys.argv):
         print("Faking Google Calendar Service for Tests")
         calendar_service = FakeCalendarService()
+        # tests swap out calendar responses constantly, so never serve cached events
+        event_cache = EventCache(ttl=0)
+        fragment_cache = FragmentCache(ttl=0)
     else:
         print("Google Calendar Service Initialized")
         calendar_service = initialize_google_calendar_service()
+        event_cache = initialize_event_cache()
+        fragment_cache = initialize_fragment_cache()
 
     # temporarily extracting email_service initialization into a seperate dyno
     # email_service = initialize_email_service()
@@ -64,9 +128,48 @@ def initialize_services():
     print("Using parameters: " + str(sys.argv))
 
 
+def initialize_scheduler():
+    """
+    Initializes the scheduler of the daemon's periodic jobs
+    """
+    # both import models, which are not ready yet when this module is imported
+    from . import tools, wakeup
+    from .scheduler import Scheduler
+
+    scheduler = Scheduler(
+        lease=getattr(settings, "SCHEDULER_LEASE", 900),
+        max_retries=getattr(settings, "SCHEDULER_MAX_RETRIES", 3),
+        backoff=getattr(settings, "SCHEDULER_RETRY_BACKOFF", 30),
+    )
+    # queue the daily assignment digests that are due, a few students at a time
+    scheduler.every(
+        getattr(settings, "DIGEST_BUCKET_MINUTES", 10) * 60,
+        "daily_digest",
+        tools.notify_students_of_today_assignments,
+    )
+    # queued notifications are sent as soon as the daemon is woken up (see wakeup), this only
+    # picks up what a lost wakeup left behind. Without postgres, other processes can not wake
+    # the daemon, so there it still checks every 10 minutes
+    sweep = 10 * 60
+    if wakeup.cross_process():
+        sweep = getattr(settings, "NOTIFICATION_SWEEP_INTERVAL", 3600)
+    scheduler.every(sweep, "send_all_messages", tools.send_all_messages)
+    # retry calendars of new users that failed to be created
+    scheduler.every(60, "provision_pending_calendars", tools.provision_pending_calendars)
+    # keep the pooled smtp connections open between sends
+    scheduler.every(60, "smtp_keepalive", lambda: email_service.pool.probe())
+    return scheduler
+
+
 def initialize_services_for_daemon():
     """
     Initializes the services for the seperate daemon
     """
     global email_service
+    global scheduler
+    global notification_listener
+    from .wakeup import Listener
+
     email_service = initialize_email_service()
+    scheduler = initialize_scheduler()
+    notification_listener = Listener()
@@ -3,10 +3,18 @@ from django.test import TestCase
 from django.contrib.auth.models import User
 from mockito import when, mock, any
 from .test_utils import *
-from . import tools, services, views, models, test_utils
+from . import tools, services, views, models, test_utils, calendar_sync
+from . import context_processors
 from .calendar_generator import Calendar
+from .event_cache import EventCache
+from .fragment_cache import FragmentCache
+from .middleware import IdentityMap, current_identity_map
 from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
 import builtins
+import os
+import smtplib
+import socket
 
 # Create your tests here.
 google_calendar_service_events_copy = services.calendar_service.events
@@ -173,6 +181,29 @@ class ViewTests(TestCase):
 
         unstub()
 
+    def test_calendar_view_colors_once_per_class(self):
+        """
+        Tests that every event lands on its own day, and colors are looked up once per class
+        """
+        events = [create_date(name=f"event {day}", day=day) for day in (3, 3, 20)]
+        events[2]["className"] = "class name"
+        when(tools).get_events(any, month=any, year=any).thenReturn(events)
+        calls = []
+        when(tools).get_color(any, any).thenAnswer(
+            lambda request, className: calls.append(className) or "#123456"
+        )
+
+        html = Calendar(year=2000, month=1).formatmonth(None)
+
+        # events are due the day after they start
+        self.assertEquals(html.count("event 3"), 2)
+        day = lambda number: html.index(f"<span class='date'>{number}</span>")
+        self.assertTrue(day(4) < html.index("event 3") < day(5))
+        self.assertTrue(day(21) < html.index("event 20"))
+        self.assertEquals(sorted(calls, key=str), sorted([None, "class name"], key=str))
+
+        unstub()
+
     def test_add_event_valid_input(self):
         """
         Tests the add event form to make sure it attempts to add an event given valid inputs
@@ -230,7 +261,7 @@ class ViewTests(TestCase):
             str(assignment_length),
             datetime.fromisoformat(assignment_date_string),
             className=None,
-        ).thenReturn(False)
+        ).thenReturn(True)
 
         user = test_utils.login(self, create_student=False)
         clazz = models.Class.objects.create(
@@ -855,16 +886,24 @@ class TestTools(TestCase):
         """
         later = datetime.now(tz=pytz.UTC) + timedelta(days=4)
         user = test_utils.login(self, create_student=True)
+        models.Student.objects.filter(userId=user.id).update(calendarId="1234")
 
-        when(tools).get_events_from_calendar_all_classes(
-            any, day=any, month=any, year=any
+        when(calendar_sync).sync_calendars(any).thenReturn(None)
+        when(tools).get_events_from_calendar(
+            any, day=any, month=any, year=any, className=any, due_in=any
         ).thenReturn([])
 
-        when(tools).get_events_from_calendar_all_classes(
-            any, day=later.day, month=later.month, year=later.year
+        when(tools).get_events_from_calendar(
+            any,
+            day=later.day,
+            month=later.month,
+            year=later.year,
+            className=any,
+            due_in=any,
         ).thenReturn([create_date(year=later.year, month=later.month, day=later.day)])
 
-        tools.notify_students_of_today_assignments()
+        with self.settings(DIGEST_HOUR=0, DIGEST_BUCKET_MINUTES=60):
+            tools.notify_students_of_today_assignments()
 
         try:
             self.assertTrue(models.Notification.objects.all().count() == 0)
@@ -878,18 +917,25 @@ class TestTools(TestCase):
         """
         user = test_utils.login(self)
 
-        # this is to fix the weird date offset
-        now = datetime.now(tz=pytz.UTC) - timedelta(days=1)
+        now = datetime.now(tz=pytz.timezone("America/New_York"))
+        models.Student.objects.filter(userId=user.id).update(calendarId="1234")
 
-        when(tools).get_events_from_calendar_all_classes(
-            any, day=any, month=any, year=any
+        when(calendar_sync).sync_calendars(any).thenReturn(None)
+        when(tools).get_events_from_calendar(
+            any, day=any, month=any, year=any, className=any, due_in=any
         ).thenReturn([])
 
-        when(tools).get_events_from_calendar_all_classes(
-            any, day=now.day, month=now.month, year=now.year
+        when(tools).get_events_from_calendar(
+            any,
+            day=now.day,
+            month=now.month,
+            year=now.year,
+            className=any,
+            due_in=any,
         ).thenReturn([create_date(year=now.year, month=now.month, day=now.day)])
 
-        tools.notify_students_of_today_assignments()
+        with self.settings(DIGEST_HOUR=0, DIGEST_BUCKET_MINUTES=60):
+            tools.notify_students_of_today_assignments()
 
         print(models.Notification.objects.all().count())
         try:
@@ -954,7 +1000,7 @@ class TestTools(TestCase):
         """
 
         clazz = models.Class.objects.create(
-            calendarId=5678, className="Class name", professorId=0
+            calendarId="5678", className="Class name", professorId=0
         )
         student = models.Student.objects.create(
             userId=0,
@@ -972,7 +1018,7 @@ class TestTools(TestCase):
         ).thenReturn([personal_event])
 
         when(tools).get_events_from_calendar(
-            5678, day=None, month=None, year=None, className="Class name"
+            "5678", day=None, month=None, year=None, className="Class name"
         ).thenReturn([class_event])
 
         try:
@@ -1258,25 +1304,26 @@ class TestTools(TestCase):
     def test_create_calendar_calendar_doesnt_exist(self):
         """
         Tests the create_calendar method in the case where a calendar doesnt exist
-        Should create calendar
+        Should mark the calendar pending without calling google, and create it in the background
         """
         when(tools).calendar_exists(any).thenReturn(False)
 
         class TestPassed(Exception):
             pass
 
+        models.Student.objects.create(userId=0, classes=set(), class_colors=dict())
         request = mock({"user": mock({"id": 0})})
 
         when(services.calendar_service).calendars().thenRaise(TestPassed)
 
         try:
             tools.create_calendar(request)
-        except TestPassed:
-            # we passed
+            self.assertTrue(tools.calendar_pending(request))
+            with self.assertRaises(TestPassed):
+                tools.provision_calendar(0)
+        finally:
             unstub()
-            return
-        unstub()
-        self.assertTrue(False)
+            models.Student.objects.filter(userId=0).delete()
 
     def test_create_calendar_calendar_doesnt_exist_null_user(self):
         """
@@ -1489,7 +1536,7 @@ class TestTools(TestCase):
         class TestFailed(Exception):
             pass
 
-        when(models.Student.objects).create(userId=any, classes=any).thenRaise(
+        when(models.Student.objects).get_or_create(userId=any, defaults=any).thenRaise(
             TestFailed
         )
 
@@ -1513,9 +1560,9 @@ class TestTools(TestCase):
         class TestPassed(Exception):
             pass
 
-        when(models.Student.objects).create(
-            userId=0, classes=any, name=any, class_colors=any
-        ).thenRaise(TestPassed)
+        when(models.Student.objects).get_or_create(userId=0, defaults=any).thenRaise(
+            TestPassed
+        )
 
         request = mock({"user": mock({"id": 0})})
 
@@ -1543,7 +1590,7 @@ class TestTools(TestCase):
             userId=0, classes=set(), color="#000000", class_colors=dict()
         )
 
-        when(models.Student.objects).create(userId=any, classes=any).thenRaise(
+        when(models.Student.objects).get_or_create(userId=any, defaults=any).thenRaise(
             TestFailed
         )
 
@@ -1620,9 +1667,21 @@ class TestTools(TestCase):
 
         # allows us to run .list(calendarId=calendarId).execute() and get an empty list
         events = [
-            {"start": {"dateTime": "2000-10-20"}, "end": {"dateTime": "2000-10-20"},},
-            {"start": {"dateTime": "2001-10-20"}, "end": {"dateTime": "2001-10-20"},},
-            {"start": {"dateTime": "2000-11-20"}, "end": {"dateTime": "2000-11-20"},},
+            {
+                "id": "1",
+                "start": {"dateTime": "2000-10-20"},
+                "end": {"dateTime": "2000-10-20"},
+            },
+            {
+                "id": "2",
+                "start": {"dateTime": "2001-10-20"},
+                "end": {"dateTime": "2001-10-20"},
+            },
+            {
+                "id": "3",
+                "start": {"dateTime": "2000-11-20"},
+                "end": {"dateTime": "2000-11-20"},
+            },
         ]
 
         class NestedPlaceholder:
@@ -1638,7 +1697,10 @@ class TestTools(TestCase):
         when(services.calendar_service).events().thenReturn(Placeholder())
 
         try:
-            self.assertEquals(tools.get_events_from_calendar(calendarId), events)
+            self.assertEquals(
+                tools.get_events_from_calendar(calendarId),
+                [dict(event, className=None) for event in events],
+            )
         finally:
             unstub()
 
@@ -1651,20 +1713,34 @@ class TestTools(TestCase):
 
         # allows us to run .list(calendarId=calendarId).execute() and get an empty list
         events = [
-            {"start": {"dateTime": "2000-10-20"}, "end": {"dateTime": "2000-10-20"},},
-            {"start": {"dateTime": "2001-10-20"}, "end": {"dateTime": "2001-10-20"},},
-            {"start": {"dateTime": "2000-11-20"}, "end": {"dateTime": "2000-11-20"},},
+            {
+                "id": "1",
+                "start": {"dateTime": "2000-10-20"},
+                "end": {"dateTime": "2000-10-20"},
+            },
+            {
+                "id": "2",
+                "start": {"dateTime": "2001-10-20"},
+                "end": {"dateTime": "2001-10-20"},
+            },
+            {
+                "id": "3",
+                "start": {"dateTime": "2000-11-20"},
+                "end": {"dateTime": "2000-11-20"},
+            },
         ]
 
         # filter events so year is 2000
         # also adds given class name, which, in this case, is None
         filtered_events = [
             {
+                "id": "1",
                 "start": {"dateTime": "2000-10-20"},
                 "end": {"dateTime": "2000-10-20"},
                 "className": None,
             },
             {
+                "id": "3",
                 "start": {"dateTime": "2000-11-20"},
                 "end": {"dateTime": "2000-11-20"},
                 "className": None,
@@ -1709,38 +1785,63 @@ class TestTools(TestCase):
         request = mock({"user": mock({"id": 0})})
 
         class_events = [
-            {"start": {"dateTime": "2000-10-20"}, "end": {"dateTime": "2000-10-20"},},
-            {"start": {"dateTime": "2001-10-20"}, "end": {"dateTime": "2001-10-20"},},
-            {"start": {"dateTime": "2000-11-20"}, "end": {"dateTime": "2000-11-20"},},
+            {
+                "id": "1",
+                "start": {"dateTime": "2000-10-20"},
+                "end": {"dateTime": "2000-10-20"},
+            },
+            {
+                "id": "2",
+                "start": {"dateTime": "2001-10-20"},
+                "end": {"dateTime": "2001-10-20"},
+            },
+            {
+                "id": "3",
+                "start": {"dateTime": "2000-11-20"},
+                "end": {"dateTime": "2000-11-20"},
+            },
         ]
 
         student_events = [
-            {"start": {"dateTime": "2002-10-20"}, "end": {"dateTime": "2002-10-20"},},
-            {"start": {"dateTime": "2003-10-20"}, "end": {"dateTime": "2003-10-20"},},
+            {
+                "id": "4",
+                "start": {"dateTime": "2002-10-20"},
+                "end": {"dateTime": "2002-10-20"},
+            },
+            {
+                "id": "5",
+                "start": {"dateTime": "2003-10-20"},
+                "end": {"dateTime": "2003-10-20"},
+            },
         ]
 
         all_events = [
             {
+                "id": "4",
                 "start": {"dateTime": "2002-10-20"},
                 "end": {"dateTime": "2002-10-20"},
                 "className": None,
             },
             {
+                "id": "5",
                 "start": {"dateTime": "2003-10-20"},
                 "end": {"dateTime": "2003-10-20"},
                 "className": None,
             },
             {
+                "id": "1",
                 "start": {"dateTime": "2000-10-20"},
                 "end": {"dateTime": "2000-10-20"},
                 "className": "class1",
             },
             {
+                "id": "2",
                 "start": {"dateTime": "2001-10-20"},
                 "end": {"dateTime": "2001-10-20"},
                 "className": "class1",
             },
             {
+                "id": "3",
                 "start": {"dateTime": "2000-11-20"},
                 "end": {"dateTime": "2000-11-20"},
                 "className": "class1",
@@ -2036,3 +2137,1816 @@ class TestTools(TestCase):
         # we failed, we never tried creating a calendar
         self.assertTrue(False)
 
+
+class EventCacheTests(TestCase):
+    def test_event_cache_miss_then_hit(self):
+        """
+        Tests that a cached listing is served after it is set, and that counters are kept
+        """
+        cache = EventCache(ttl=300)
+
+        self.assertEquals(cache.get("calendar"), None)
+        cache.set("calendar", [create_date()])
+
+        self.assertEquals(cache.get("calendar"), [create_date()])
+        self.assertEquals(cache.stats()["hits"], 1)
+        self.assertEquals(cache.stats()["misses"], 1)
+
+    def test_event_cache_returns_copies(self):
+        """
+        Tests that callers tagging events with a className do not change the cached events
+        """
+        cache = EventCache(ttl=300)
+        cache.set("calendar", [create_date()])
+
+        cache.get("calendar")[0]["className"] = "class name"
+
+        self.assertEquals(cache.get("calendar")[0]["className"], None)
+
+    def test_event_cache_disabled(self):
+        """
+        Tests that a ttl of 0 never caches anything
+        """
+        cache = EventCache(ttl=0)
+        cache.set("calendar", [create_date()])
+
+        self.assertEquals(cache.get("calendar"), None)
+
+    def test_event_cache_needs_shared_backend(self):
+        """
+        Tests that the event cache is only turned on with a backend shared by every worker
+        """
+        with self.settings(EVENT_CACHE_BACKEND=None, EVENT_CACHE_TTL=300):
+            self.assertEquals(services.initialize_event_cache().ttl, 0)
+        with self.settings(EVENT_CACHE_BACKEND="default", EVENT_CACHE_TTL=300):
+            self.assertEquals(services.initialize_event_cache().ttl, 300)
+
+    def test_event_cache_lru_eviction(self):
+        """
+        Tests that the least recently used calendar is evicted once the cache is full
+        """
+        cache = EventCache(ttl=300, max_entries=2)
+        cache.set("first", [])
+        cache.set("second", [])
+        cache.get("first")
+        cache.set("third", [])
+
+        self.assertEquals(cache.get("second"), None)
+        self.assertEquals(cache.get("first"), [])
+        self.assertEquals(cache.stats()["evictions"], 1)
+
+    def test_event_cache_invalidate(self):
+        """
+        Tests that invalidating a calendar drops every window cached for it, and only for it
+        """
+        cache = EventCache(ttl=300)
+        cache.set("calendar", [create_date()])
+        cache.set("calendar", [create_date()], "future:2000-01-01")
+        cache.set("other calendar", [create_date()])
+
+        cache.invalidate("calendar")
+
+        self.assertEquals(cache.get("calendar"), None)
+        self.assertEquals(cache.get("calendar", "future:2000-01-01"), None)
+        self.assertEquals(cache.get("other calendar"), [create_date()])
+
+    def test_event_cache_shared_tier_invalidate(self):
+        """
+        Tests that invalidating through the shared tier also hides entries cached by another process
+        """
+        other_process = EventCache(ttl=300, backend="default")
+        this_process = EventCache(ttl=300, backend="default")
+
+        try:
+            other_process.set("calendar", [create_date()])
+            self.assertEquals(this_process.get("calendar"), [create_date()])
+
+            this_process.invalidate("calendar")
+
+            self.assertEquals(other_process.get("calendar"), None)
+        finally:
+            from django.core.cache import cache
+
+            cache.clear()
+
+    def test_create_event_invalidates_cache(self):
+        """
+        Tests that creating an event drops the cached listing of that calendar, and writes
+        the new event through to the local event store
+        """
+        when(tools).calendar_exists(any).thenReturn(True)
+        when(tools).create_calendar(any).thenReturn(True)
+        when(tools).get_student(any).thenReturn(mock({"calendarId": 1234}))
+
+        class Placeholder:
+            def insert(*args, **kwargs):
+                return mock({"execute": lambda: create_date()})
+
+        when(services.calendar_service).events().thenReturn(Placeholder())
+
+        temp_event_cache = services.event_cache
+        services.event_cache = EventCache(ttl=300)
+        services.event_cache.set(1234, [create_date()])
+
+        try:
+            tools.create_event(
+                None, "good summary", None, datetime.fromisoformat("2000-01-01")
+            )
+            self.assertEquals(services.event_cache.get(1234), None)
+            self.assertEquals(len(calendar_sync.stored_events(1234)), 1)
+        finally:
+            unstub()
+            services.event_cache = temp_event_cache
+
+
+class FetchConcurrentlyTests(TestCase):
+    def test_fetch_concurrently_keeps_order(self):
+        """
+        Tests that results come back in the order of the calls, no matter which finishes first
+        """
+        import time
+
+        def call(i):
+            time.sleep(0.01 * (5 - i))
+            return i
+
+        calls = [lambda i=i: call(i) for i in range(5)]
+
+        self.assertEquals(tools.fetch_concurrently(calls), [0, 1, 2, 3, 4])
+
+    def test_fetch_concurrently_max_in_flight(self):
+        """
+        Tests that no more than CALENDAR_FETCH_MAX_IN_FLIGHT calls run at once, but that they do overlap
+        """
+        import threading
+        import time
+
+        lock = threading.Lock()
+        counts = {"running": 0, "peak": 0}
+
+        def call():
+            with lock:
+                counts["running"] += 1
+                counts["peak"] = max(counts["peak"], counts["running"])
+            time.sleep(0.02)
+            with lock:
+                counts["running"] -= 1
+
+        with self.settings(CALENDAR_FETCH_MAX_IN_FLIGHT=3):
+            tools.fetch_concurrently([call for i in range(9)])
+
+        self.assertEquals(counts["peak"], 3)
+
+    def test_fetch_concurrently_timeout(self):
+        """
+        Tests that a call taking longer than CALENDAR_FETCH_TIMEOUT raises instead of blocking the page
+        """
+        import time
+        from concurrent.futures import TimeoutError
+
+        with self.settings(CALENDAR_FETCH_TIMEOUT=0.01):
+            with self.assertRaises(TimeoutError):
+                tools.fetch_concurrently([lambda: None, lambda: time.sleep(0.5)])
+
+    def test_fetch_concurrently_return_errors(self):
+        """
+        Tests that with return_errors, a failing or slow call does not fail the others
+        """
+        import time
+
+        def fail():
+            raise ValueError("bad calendar")
+
+        with self.settings(CALENDAR_FETCH_TIMEOUT=0.1):
+            results = tools.fetch_concurrently(
+                [lambda: 1, fail, lambda: time.sleep(0.5)], return_errors=True
+            )
+
+        self.assertEquals(results[0], (1, None))
+        self.assertIsInstance(results[1][1], ValueError)
+        self.assertEquals(results[2][0], None)
+        self.assertNotEqual(results[2][1], None)
+
+
+class TimeWindowTests(TestCase):
+    def test_time_window_unbounded(self):
+        """
+        Tests that no window is produced when there is no year to bound it
+        """
+        self.assertEquals(tools.time_window(), (None, None))
+        self.assertEquals(tools.time_window(month=1), (None, None))
+        self.assertEquals(tools.time_window(day=1, year=2000), (None, None))
+
+    def test_time_window_month(self):
+        """
+        Tests the window for a month, padded by a day on each side
+        """
+        self.assertEquals(
+            tools.time_window(month=12, year=2000),
+            (
+                pytz.utc.localize(datetime(2000, 11, 30)),
+                pytz.utc.localize(datetime(2001, 1, 2)),
+            ),
+        )
+
+    def test_time_window_day(self):
+        """
+        Tests the window for a single day, padded by a day on each side
+        """
+        self.assertEquals(
+            tools.time_window(day=1, month=3, year=2000),
+            (
+                pytz.utc.localize(datetime(2000, 2, 29)),
+                pytz.utc.localize(datetime(2000, 3, 3)),
+            ),
+        )
+
+
+class CalendarSyncTests(TestCase):
+    def placeholder(self, pages, calls):
+        """
+        Returns a fake events() resource serving pages keyed by (syncToken, pageToken)
+        Every list call is recorded in calls
+        """
+
+        class NestedPlaceholder:
+            def __init__(self, page):
+                self.page = page
+
+            def execute(self, http=None):
+                if isinstance(self.page, Exception):
+                    raise self.page
+                return self.page
+
+        class Placeholder:
+            def list(*args, **kwargs):
+                calls.append(kwargs)
+                return NestedPlaceholder(
+                    pages[(kwargs.get("syncToken"), kwargs.get("pageToken"))]
+                )
+
+        return Placeholder()
+
+    def test_sync_follows_pages(self):
+        """
+        Tests that events past the first page of results are stored too
+        """
+        first = create_date(name="first")
+        second = dict(create_date(name="second"), id=5678)
+        pages = {
+            (None, None): {"items": [first], "nextPageToken": "next"},
+            (None, "next"): {"items": [second], "nextSyncToken": "token"},
+        }
+        calls = []
+        when(services.calendar_service).events().thenReturn(
+            self.placeholder(pages, calls)
+        )
+
+        try:
+            events = tools.get_events_from_calendar(0)
+            self.assertEquals([event["summary"] for event in events], ["first", "second"])
+            self.assertEquals(
+                models.CalendarSyncState.objects.get(calendarId="0").syncToken, "token"
+            )
+        finally:
+            unstub()
+
+    def test_sync_reads_from_store(self):
+        """
+        Tests that a calendar synced recently is read from the store without asking the api
+        """
+        pages = {(None, None): {"items": [create_date()], "nextSyncToken": "token"}}
+        calls = []
+        when(services.calendar_service).events().thenReturn(
+            self.placeholder(pages, calls)
+        )
+
+        try:
+            tools.get_events_from_calendar(0)
+            events = tools.get_events_from_calendar(0, month=1, year=2000)
+            self.assertEquals(len(events), 1)
+            self.assertEquals(len(calls), 1)
+        finally:
+            unstub()
+
+    def test_sync_applies_deltas(self):
+        """
+        Tests that a stale calendar only pulls changes with its syncToken, and applies them
+        """
+        kept = create_date(name="kept")
+        removed = dict(create_date(name="removed"), id=5678)
+        pages = {
+            (None, None): {"items": [kept, removed], "nextSyncToken": "first"},
+            ("first", None): {
+                "items": [
+                    dict(kept, summary="renamed"),
+                    {"id": 5678, "status": "cancelled"},
+                ],
+                "nextSyncToken": "second",
+            },
+        }
+        calls = []
+        when(services.calendar_service).events().thenReturn(
+            self.placeholder(pages, calls)
+        )
+
+        try:
+            calendar_sync.sync_calendars([0])
+            calendar_sync.sync_calendars([0], force=True)
+            self.assertEquals(
+                [event["summary"] for event in calendar_sync.stored_events(0)],
+                ["renamed"],
+            )
+            self.assertEquals(calls[1]["syncToken"], "first")
+        finally:
+            unstub()
+
+    def test_sync_expired_token_full_resync(self):
+        """
+        Tests that a 410 for an expired syncToken throws away the store and lists everything again
+        """
+        from googleapiclient.errors import HttpError
+
+        models.CalendarEvent.objects.create(
+            calendarId="0",
+            eventId="old",
+            start=datetime.now(tz=pytz.utc),
+            end=datetime.now(tz=pytz.utc),
+            data={"id": "old"},
+        )
+        models.CalendarSyncState.objects.create(calendarId="0", syncToken="expired")
+        pages = {
+            ("expired", None): HttpError(mock({"status": 410, "reason": "Gone"}), b""),
+            (None, None): {"items": [create_date()], "nextSyncToken": "new"},
+        }
+        calls = []
+        when(services.calendar_service).events().thenReturn(
+            self.placeholder(pages, calls)
+        )
+
+        try:
+            calendar_sync.sync_calendars([0])
+            self.assertEquals(
+                [event["id"] for event in calendar_sync.stored_events(0)], [1234]
+            )
+            self.assertEquals(
+                models.CalendarSyncState.objects.get(calendarId="0").syncToken, "new"
+            )
+        finally:
+            unstub()
+
+
+    def test_sync_page_failure_keeps_store(self):
+        """
+        Tests that a calendar failing past its first page is skipped, and what is stored for
+        it is still served
+        """
+        from googleapiclient.errors import HttpError
+
+        models.CalendarEvent.objects.create(
+            calendarId="0",
+            eventId="old",
+            start=datetime.now(tz=pytz.utc),
+            end=datetime.now(tz=pytz.utc),
+            data={"id": "old"},
+        )
+        pages = {
+            (None, None): {"items": [create_date()], "nextPageToken": "next"},
+            (None, "next"): HttpError(mock({"status": 500, "reason": "Error"}), b""),
+        }
+        calls = []
+        when(services.calendar_service).events().thenReturn(
+            self.placeholder(pages, calls)
+        )
+
+        try:
+            events = tools.get_events_from_calendar(0)
+            self.assertEquals([event["id"] for event in events], ["old"])
+            self.assertFalse(models.CalendarSyncState.objects.exists())
+        finally:
+            unstub()
+
+class BatchingTests(TestCase):
+    class StubService:
+        """
+        Local stand in for the calendar api that supports batches, and counts http round trips
+        """
+
+        def __init__(self, fail=()):
+            self.round_trips = 0
+            self.fail = fail
+            self.inserted = []
+
+        def events(self):
+            service = self
+
+            class Request:
+                def __init__(self, response):
+                    self.response = response
+
+                def execute(self, http=None):
+                    if isinstance(self.response, Exception):
+                        raise self.response
+                    return self.response
+
+            class Events:
+                def list(self, calendarId, **kwargs):
+                    if calendarId in service.fail:
+                        return Request(ValueError(f"bad calendar {calendarId}"))
+                    event = dict(create_date(name=calendarId), id=calendarId)
+                    return Request({"items": [event], "nextSyncToken": "token"})
+
+                def insert(self, calendarId, body):
+                    if body["summary"] in service.fail:
+                        return Request(ValueError(f"bad event {body['summary']}"))
+                    service.inserted.append(body["summary"])
+                    return Request(dict(body, id=body["summary"]))
+
+            return Events()
+
+        def new_batch_http_request(self):
+            service = self
+
+            class Batch:
+                def __init__(self):
+                    self.requests = []
+
+                def add(self, request, callback, request_id):
+                    self.requests.append((request, callback, request_id))
+
+                def execute(self, http=None):
+                    service.round_trips += 1
+                    for request, callback, request_id in self.requests:
+                        try:
+                            callback(request_id, request.execute(), None)
+                        except Exception as e:
+                            callback(request_id, None, e)
+
+            return Batch()
+
+    def setUp(self):
+        self.calendar_service = services.calendar_service
+
+    def tearDown(self):
+        services.calendar_service = self.calendar_service
+
+    def test_batched_sync_round_trips(self):
+        """
+        Tests that syncing 120 calendars takes ceil(120 / 50) = 3 round trips instead of 120
+        """
+        services.calendar_service = self.StubService()
+        calendarIds = [f"calendar {i}" for i in range(120)]
+
+        calendar_sync.sync_calendars(calendarIds)
+
+        self.assertEquals(services.calendar_service.round_trips, 3)
+        self.assertEquals(models.CalendarEvent.objects.count(), 120)
+
+    def test_batched_sync_item_failure(self):
+        """
+        Tests that one calendar failing to sync does not stop the rest of its batch
+        """
+        services.calendar_service = self.StubService(fail=("calendar 1",))
+
+        calendar_sync.sync_calendars(["calendar 0", "calendar 1", "calendar 2"])
+
+        self.assertEquals(
+            sorted(models.CalendarSyncState.objects.values_list("calendarId", flat=True)),
+            ["calendar 0", "calendar 2"],
+        )
+
+    def test_upload_syllabus_batched_inserts(self):
+        """
+        Tests that a syllabus is inserted in batches, and a bad row does not fail the others
+        """
+        services.calendar_service = self.StubService(fail=("bad",))
+        models.Class.objects.create(
+            className="class name", calendarId="class calendar", professorId=0
+        )
+        lines = [f"hw {i},2000-01-01,1" for i in range(60)] + ["bad,2000-01-01,1"]
+        csv_file = SimpleUploadedFile("syllabus.csv", "\n".join(lines).encode("utf-8"))
+        request = mock({"FILES": {"file": csv_file}})
+
+        report = tools.upload_syllabus(request, None, "class name")
+
+        self.assertEquals(len(report["created"]), 60)
+        self.assertEquals([row["name"] for row in report["failed"]], ["bad"])
+        # one round trip to sync the class calendar, two for the inserts
+        self.assertEquals(services.calendar_service.round_trips, 3)
+        self.assertEquals(len(services.calendar_service.inserted), 60)
+        # the stub lists one event for every calendar, on top of the 60 inserted
+        self.assertEquals(len(calendar_sync.stored_events("class calendar")), 61)
+
+
+class SyllabusTests(TestCase):
+    def test_parse_syllabus(self):
+        """
+        Tests parsing a syllabus, including quoted names, blank lines and invalid rows
+        """
+        csv_file = SimpleUploadedFile(
+            "syllabus.csv",
+            b'homework 1, 2000-01-01, 4\n\n"read chapters 1, 2",2000-01-02,2\n'
+            b"homework 2,2000-13-01,1\nhomework 3\n",
+        )
+
+        rows = list(tools.parse_syllabus(csv_file))
+
+        self.assertEquals(
+            [(row["line"], row["name"], row["error"]) for row in rows],
+            [
+                (1, "homework 1", None),
+                (3, "read chapters 1, 2", None),
+                (4, "homework 2", "invalid date '2000-13-01'"),
+                (5, "", "expected: name, YYYY-MM-DD, duration"),
+            ],
+        )
+        self.assertEquals(rows[0]["time"], pytz.utc.localize(datetime(2000, 1, 1)))
+
+    def test_upload_syllabus_duplicates(self):
+        """
+        Tests that rows already in the class calendar, or repeated in the file, are not created again
+        """
+        clazz = models.Class.objects.create(
+            className="class name", calendarId="class calendar", professorId=0
+        )
+        calendar_sync.apply_changes(
+            "class calendar", [create_date(name="homework 1")], "token", True
+        )
+        csv_file = SimpleUploadedFile(
+            "syllabus.csv",
+            b"homework 1,2000-01-01,1\nhomework 2,2000-01-01,1\nhomework 2,2000-01-01,1\n",
+        )
+        request = mock({"FILES": {"file": csv_file}})
+
+        when(tools).insert_events("class calendar", any).thenReturn([(None, None)])
+
+        try:
+            report = tools.upload_syllabus(request, None, "class name")
+            self.assertEquals([row["line"] for row in report["created"]], [2])
+            self.assertEquals([row["line"] for row in report["duplicated"]], [1, 3])
+            self.assertEquals(report["failed"], [])
+        finally:
+            unstub()
+
+
+class IdentityMapTests(TestCase):
+    def test_identity_map_loads_student_once(self):
+        """
+        Tests that student helpers share one query when the request has an identity map
+        """
+        user = test_utils.login(self)
+        request = mock(
+            {"user": mock({"id": user.id}), "identity_map": IdentityMap(user.id)}
+        )
+
+        try:
+            with self.assertNumQueries(1):
+                self.assertTrue(tools.student_exists(request))
+                self.assertFalse(tools.is_professor(request))
+                self.assertFalse(tools.calendar_exists(request))
+                self.assertEquals(tools.get_student(request).color, "#000000")
+        finally:
+            test_utils.logout(self, user)
+
+    def test_identity_map_loads_class_once(self):
+        """
+        Tests that class helpers share one query while an identity map is active
+        A class that does not exist yet is looked up again, since it may be created later
+        """
+        models.Class.objects.create(className="class name", professorId=0)
+        token = current_identity_map.set(IdentityMap(None))
+
+        try:
+            with self.assertNumQueries(1):
+                self.assertTrue(tools.class_exists("class name"))
+                self.assertEquals(tools.get_class("class name").professorId, 0)
+            with self.assertNumQueries(2):
+                self.assertFalse(tools.class_exists("other class"))
+                self.assertFalse(tools.class_exists("other class"))
+        finally:
+            current_identity_map.reset(token)
+
+    def test_identity_map_middleware_query_count(self):
+        """
+        Tests that the number of queries made for a request is reported with DEBUG on
+        """
+        user = test_utils.login(self)
+
+        try:
+            with self.settings(DEBUG=True):
+                response = self.client.get(reverse("classes"))
+            self.assertTrue(int(response["X-Query-Count"]) > 0)
+            self.assertEquals(
+                response.wsgi_request.query_count, int(response["X-Query-Count"])
+            )
+        finally:
+            test_utils.logout(self, user)
+
+
+class EnrollmentTests(TestCase):
+    def test_student_classes_saved_as_enrollments(self):
+        """
+        Tests that classes and colors given to a new student are stored as Enrollment rows
+        """
+        clazz = models.Class.objects.create(className="class name", professorId=0)
+        student = models.Student.objects.create(
+            userId=0, classes={clazz}, class_colors={clazz: "#123456"}
+        )
+
+        enrollment = models.Enrollment.objects.get(student=student)
+        self.assertEquals(enrollment.clazz, clazz)
+        self.assertEquals(enrollment.color, "#123456")
+        self.assertEquals(
+            models.Student.objects.get(userId=0).class_colors, {clazz: "#123456"}
+        )
+
+    def test_set_class_color(self):
+        """
+        Tests that changing the color of a class only changes that student's enrollment
+        """
+        clazz = models.Class.objects.create(className="class name", professorId=0)
+        models.Student.objects.create(userId=0, classes={clazz})
+        models.Student.objects.create(userId=1, classes={clazz})
+        request = mock({"user": mock({"id": 0})})
+
+        tools.set_class_color(request, "class name", "#123456")
+
+        self.assertEquals(tools.get_color(request, "class name"), "#123456")
+        self.assertEquals(
+            models.Enrollment.objects.get(student__userId=1).color, "#0052bd"
+        )
+
+    def test_get_all_students_single_query(self):
+        """
+        Tests that finding the students of a class is one query, however many students there are
+        """
+        clazz = models.Class.objects.create(className="class name", professorId=0)
+        other = models.Class.objects.create(className="other class", professorId=0)
+        for userId in range(20):
+            models.Student.objects.create(
+                userId=userId, classes={clazz} if userId % 2 == 0 else {other}
+            )
+
+        with self.assertNumQueries(1):
+            students = tools.get_all_students("class name")
+
+        self.assertEquals(
+            sorted(student.userId for student in students), list(range(0, 20, 2))
+        )
+
+    def test_migrate_enrollments(self):
+        """
+        Tests moving pickled classes and colors into Enrollment rows, skipping deleted classes
+        """
+        import importlib
+        from django.apps import apps
+
+        migration = importlib.import_module("mainapp.migrations.0002_enrollments")
+
+        clazz = models.Class.objects.create(className="class name", professorId=0)
+        deleted = models.Class.objects.create(className="deleted class", professorId=0)
+        student = models.Student.objects.create(userId=0)
+        student.legacy_classes = {clazz, deleted}
+        student.legacy_class_colors = {clazz: "#123456", deleted: "#654321"}
+        student.save()
+        deleted.delete()
+
+        migration.copy_enrollments(apps, None)
+        migration.copy_enrollments(apps, None)
+
+        student = models.Student.objects.get(userId=0)
+        self.assertEquals(student.classes, {clazz})
+        self.assertEquals(student.class_colors, {clazz: "#123456"})
+        self.assertEquals(student.legacy_classes, None)
+
+    def test_benchmark_get_all_students(self):
+        """
+        Tests that the get_all_students benchmark runs, and leaves no synthetic data behind
+        """
+        from django.core.management import call_command
+
+        call_command("benchmark_get_all_students", students=50, classes=5)
+
+        self.assertEquals(models.Student.objects.count(), 0)
+        self.assertEquals(models.Class.objects.count(), 0)
+
+
+class IndexUsageTests(TestCase):
+    """
+    Runs EXPLAIN on the queries tools.py makes on almost every request, and checks the
+    database answers them from an index instead of scanning the whole table
+    Works on sqlite and postgresql
+    """
+
+    def assertIndexScan(self, queryset):
+        from django.db import connection
+
+        if connection.vendor == "postgresql":
+            # tables in tests are tiny, so postgres would happily scan them. only let it
+            # scan if there is no index it could use (SET LOCAL ends with the test transaction)
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            plan = queryset.explain()
+            self.assertNotIn("Seq Scan", plan, plan)
+        else:
+            plan = queryset.explain()
+            # sqlite reports SEARCH for index lookups, and SCAN for reading a whole table
+            self.assertNotRegex(plan, r"\bSCAN\b", plan)
+
+    def test_get_student_uses_index(self):
+        """
+        Tests that get_student looks a student up by userId through an index
+        """
+        self.assertIndexScan(models.Student.objects.filter(userId=0))
+
+    def test_get_class_uses_index(self):
+        """
+        Tests that get_class looks a class up by className through an index
+        """
+        self.assertIndexScan(models.Class.objects.filter(className="class name"))
+
+    def test_file_list_uses_index(self):
+        """
+        Tests that the file list of a class is found through an index
+        """
+        self.assertIndexScan(models.File.objects.filter(className="class name"))
+
+    def test_get_checked_off_uses_index(self):
+        """
+        Tests that the checked off assignments of a student are found through an index
+        (the userId prefix of the unique constraint), like get_checked_off loads them
+        """
+        self.assertIndexScan(
+            models.CheckedAssignments.objects.filter(userId=0).values_list(
+                "className", "eventId"
+            )
+        )
+
+    def test_student_classes_uses_index(self):
+        """
+        Tests that the enrollments of a student are found through an index
+        """
+        student = models.Student.objects.create(userId=0)
+        self.assertIndexScan(student.enrollments.select_related("clazz"))
+
+    def test_get_all_students_uses_index(self):
+        """
+        Tests that the students of a class are found through indexes
+        """
+        self.assertIndexScan(
+            models.Student.objects.filter(enrollments__clazz__className="class name")
+        )
+
+    def test_stored_events_uses_index(self):
+        """
+        Tests that future events of a calendar are found through an index
+        """
+        self.assertIndexScan(
+            models.CalendarEvent.objects.filter(
+                calendarId="calendar", end__gt=datetime.now(tz=pytz.utc)
+            )
+        )
+
+
+class CheckedOffTests(TestCase):
+    def test_get_checked_off_single_query(self):
+        """
+        Tests that all checked off assignments of a student are loaded in one query, and
+        only once per request
+        """
+        user = test_utils.login(self)
+        models.CheckedAssignments.objects.create(
+            userId=user.id, className="None", eventId="1"
+        )
+        models.CheckedAssignments.objects.create(
+            userId=user.id, className="class name", eventId="2"
+        )
+        models.CheckedAssignments.objects.create(
+            userId=user.id + 1, className="None", eventId="3"
+        )
+        request = mock(
+            {"user": mock({"id": user.id}), "identity_map": IdentityMap(user.id)}
+        )
+
+        try:
+            with self.assertNumQueries(2):
+                self.assertEquals(
+                    tools.get_checked_off(request), {("None", "1"), ("class name", "2")}
+                )
+                self.assertTrue(tools.is_checked_off(request, "1", None))
+                self.assertFalse(tools.is_checked_off(request, "3", None))
+        finally:
+            test_utils.logout(self, user)
+
+    def test_check_off_toggles(self):
+        """
+        Tests that checking off an assignment twice unchecks it again
+        """
+        user = test_utils.login(self)
+        request = mock(
+            {"user": mock({"id": user.id}), "identity_map": IdentityMap(user.id)}
+        )
+
+        try:
+            tools.check_off(request, "1", "None")
+            self.assertTrue(tools.is_checked_off(request, "1", "None"))
+            tools.check_off(request, "1", "None")
+            self.assertFalse(tools.is_checked_off(request, "1", "None"))
+            self.assertEquals(models.CheckedAssignments.objects.count(), 0)
+        finally:
+            test_utils.logout(self, user)
+
+
+class TodoListTests(TestCase):
+    def test_render_todo_list_rows(self):
+        """
+        Tests that the todo list shows labels, check off state and the right buttons per event
+        """
+        user = test_utils.login(self)
+        clazz = models.Class.objects.create(
+            className="class name", professorId=user.id, calendarId="5678"
+        )
+        student = models.Student.objects.get(userId=user.id)
+        student.classes = {clazz}
+        student.class_colors = {clazz: "#123456"}
+        student.save()
+        models.CheckedAssignments.objects.create(
+            userId=user.id, className="None", eventId="1"
+        )
+        request = mock(
+            {"user": mock({"id": user.id}), "identity_map": IdentityMap(user.id)}
+        )
+        personal = test_utils.create_date("personal <b>", 3000)
+        personal["id"] = "1"
+        owned = test_utils.create_date("owned", 3000)
+        owned["id"] = "2"
+        owned["className"] = "class name"
+
+        try:
+            html = tools.render_todo_list(
+                request, [personal, owned], editable=True, todo_loc=True
+            )
+            self.assertIn("Personal", html)
+            self.assertIn("personal &lt;b&gt;", html)
+            self.assertIn("background-color:#123456;", html)
+            self.assertIn('href="None/1/delete_assignment/"', html)
+            self.assertIn('href="class name/2/delete_assignment/"', html)
+            self.assertIn("color:gray;", html)
+            self.assertEquals(html.count("Delete</button>"), 2)
+
+            html = tools.render_todo_list(request, [personal], className="class name")
+            self.assertNotIn("Personal", html)
+            self.assertNotIn("<a href", html)
+        finally:
+            test_utils.logout(self, user)
+
+    def test_render_todo_list_queries_do_not_grow(self):
+        """
+        Tests that rendering more events for the same classes does not run more queries
+        """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        user = test_utils.login(self)
+        events = []
+        for i in range(50):
+            event = test_utils.create_date(f"event {i}", 3000)
+            event["id"] = str(i)
+            events.append(event)
+
+        def count(events):
+            request = mock(
+                {"user": mock({"id": user.id}), "identity_map": IdentityMap(user.id)}
+            )
+            with CaptureQueriesContext(connection) as queries:
+                tools.render_todo_list(request, events, editable=True)
+            return len(queries)
+
+        try:
+            self.assertEquals(count(events[:1]), count(events))
+        finally:
+            test_utils.logout(self, user)
+
+    def test_benchmark_todo_list(self):
+        """
+        Tests that the todo list benchmark runs, and leaves no synthetic data behind
+        """
+        from django.core.management import call_command
+
+        call_command("benchmark_todo_list", sizes=[10], repeat=1)
+        self.assertEquals(models.Class.objects.count(), 0)
+        self.assertEquals(models.Student.objects.count(), 0)
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        self.fragment_cache = services.fragment_cache
+        services.fragment_cache = FragmentCache(ttl=300)
+
+    def tearDown(self):
+        services.fragment_cache = self.fragment_cache
+        unstub()
+
+    def test_fragment_cache_stamps(self):
+        """
+        Tests that bumping a stamp only moves that stamp, in the local and shared tiers
+        """
+        local = FragmentCache(ttl=300)
+        shared = FragmentCache(ttl=300, backend="default")
+        for cache in [local, shared]:
+            cache.bump("calendar:1")
+            cache.bump("calendar:1")
+            self.assertEquals(cache.stamps("calendar:1", "calendar:2"), [2, 0])
+        shared.shared().clear()
+
+    def test_fragment_cache_needs_shared_backend(self):
+        """
+        Tests that the fragment cache is only turned on with a backend shared by every worker
+        """
+        with self.settings(FRAGMENT_CACHE_BACKEND=None, FRAGMENT_CACHE_TTL=300):
+            self.assertEquals(services.initialize_fragment_cache().ttl, 0)
+        with self.settings(FRAGMENT_CACHE_BACKEND="default", FRAGMENT_CACHE_TTL=300):
+            self.assertEquals(services.initialize_fragment_cache().ttl, 300)
+
+    def test_fragment_cache_disabled(self):
+        """
+        Tests that a ttl of 0 never caches anything
+        """
+        cache = FragmentCache(ttl=0)
+        cache.set(cache.key("month"), "<table>")
+
+        self.assertEquals(cache.get(cache.key("month")), None)
+
+    def test_todo_list_served_from_cache(self):
+        """
+        Tests that a repeat todo list is a cache hit, and that checking off an assignment,
+        changing a color or writing to the calendar renders it again
+        """
+        user = test_utils.login(self)
+        models.Student.objects.filter(userId=user.id).update(calendarId="1234")
+        request = mock(
+            {"user": mock({"id": user.id}), "identity_map": IdentityMap(user.id)}
+        )
+        event = test_utils.create_date("assignment", 3000)
+        renders = []
+        when(tools).get_future_events(any, any).thenAnswer(
+            lambda request, className: renders.append(className) or [dict(event)]
+        )
+
+        try:
+            first = tools.todo_list(request, editable=True)
+            self.assertEquals(tools.todo_list(request, editable=True), first)
+            self.assertEquals(len(renders), 1)
+
+            tools.check_off(request, "1234", "None")
+            self.assertIn("color:gray;", tools.todo_list(request, editable=True))
+            tools.set_class_color(request, None, "#654321")
+            self.assertIn("#654321", tools.todo_list(request, editable=True))
+            tools.calendar_changed(tools.get_student(request).calendarId)
+            tools.todo_list(request, editable=True)
+            self.assertEquals(len(renders), 4)
+
+            stats = services.fragment_cache.stats()
+            self.assertEquals((stats["hits"], stats["misses"]), (1, 4))
+            self.assertEquals(stats["hit_ratio"], 0.2)
+        finally:
+            test_utils.logout(self, user)
+
+
+class ContextProcessorTests(TestCase):
+    def tearDown(self):
+        unstub()
+
+    def test_user_context_is_lazy(self):
+        """
+        Tests that template values are only looked up when used, and the url only parsed once
+        """
+        from django.test.client import RequestFactory
+
+        calls = []
+        when(tools).className_from_url(any).thenAnswer(
+            lambda request: calls.append("url") or "class name"
+        )
+        when(tools).is_professor(any).thenAnswer(
+            lambda request: calls.append("professor") or True
+        )
+        when(tools).get_color(any, any).thenAnswer(
+            lambda request, className: calls.append(className) or "#123456"
+        )
+        when(tools).is_professor_for_class(any, any).thenAnswer(
+            lambda request, className: calls.append(className) or False
+        )
+        request = RequestFactory().get("/classes/class name/view/")
+
+        context = context_processors.user_context(request)
+        self.assertEquals(calls, [])
+
+        self.assertEquals(str(context["CLASS_COLOR"]), "#123456")
+        self.assertFalse(context["IS_ASSIGNED_PROFESSOR"])
+        self.assertEquals(calls, ["url", "class name", "class name"])
+
+        self.assertTrue(context_processors.user_context(request)["USER_IS_PROFESSOR"])
+        self.assertEquals(calls[-1], "professor")
+
+
+class StudentMiddlewareTests(TestCase):
+    def test_student_created_on_first_request(self):
+        """
+        Tests that a logged in user gets a student on their first request, and keeps it
+        """
+        user = test_utils.login(self, create_student=False)
+
+        try:
+            request = test_utils.get_request(self, "/classes/")
+            student = request.identity_map.student()
+            self.assertEquals(student.userId, user.id)
+            self.assertEquals(student.name, user.username)
+
+            request = test_utils.get_request(self, "/classes/")
+            self.assertEquals(models.Student.objects.filter(userId=user.id).count(), 1)
+        finally:
+            test_utils.logout(self, user)
+
+    def test_concurrent_first_requests(self):
+        """
+        Tests that a request that missed the student another request just created does not fail
+        """
+        user = test_utils.login(self, create_student=False)
+        request = mock({"user": user, "identity_map": IdentityMap(user.id)})
+
+        try:
+            tools.initialize_user(request)
+            # the second request checked before the first one created the student
+            when(tools).student_exists(any).thenReturn(False)
+            tools.initialize_user(request)
+
+            self.assertEquals(models.Student.objects.filter(userId=user.id).count(), 1)
+        finally:
+            unstub()
+            test_utils.logout(self, user)
+
+    def test_no_student_for_anonymous_user(self):
+        """
+        Tests that anonymous users do not get a student
+        """
+        test_utils.get_request(self, "/classes/")
+
+        self.assertEquals(models.Student.objects.count(), 0)
+
+
+class CalendarProvisioningTests(TestCase):
+    def setUp(self):
+        self.inserted = []
+        self.deleted = []
+        test = self
+
+        class FakeCalendars:
+            def insert(self, body):
+                test.inserted.append(body)
+                created = {"id": f"calendar {len(test.inserted)}"}
+                return mock({"execute": lambda: created})
+
+            def delete(self, calendarId):
+                test.deleted.append(calendarId)
+                return mock({"execute": lambda: None})
+
+        when(services.calendar_service).calendars().thenReturn(FakeCalendars())
+        models.Student.objects.create(userId=0, classes=set(), class_colors=dict())
+
+    def tearDown(self):
+        unstub()
+
+    def test_provision_calendar_is_idempotent(self):
+        """
+        Tests that a pending calendar is created once, however many times it is provisioned
+        """
+        self.assertTrue(tools.provision_calendar(0))
+        self.assertTrue(tools.provision_calendar(0))
+        tools.provision_pending_calendars()
+
+        student = models.Student.objects.get(userId=0)
+        self.assertEquals(student.calendarId, "calendar 1")
+        self.assertFalse(student.calendar_pending)
+        self.assertEquals(len(self.inserted), 1)
+
+    def test_provision_calendar_claimed(self):
+        """
+        Tests that a calendar claimed by another worker is left alone until the claim expires
+        """
+        now = datetime.now(tz=pytz.utc)
+        models.Student.objects.filter(userId=0).update(
+            calendar_pending=True, calendar_claimed=now
+        )
+
+        self.assertFalse(tools.provision_calendar(0))
+        self.assertEquals(self.inserted, [])
+
+        models.Student.objects.filter(userId=0).update(
+            calendar_claimed=now - timedelta(hours=1)
+        )
+        self.assertTrue(tools.provision_calendar(0))
+        self.assertEquals(len(self.inserted), 1)
+
+    def test_provision_calendar_lost_race(self):
+        """
+        Tests that a calendar created after another worker already stored one is deleted again
+        """
+        def store_first(userId, calendarId):
+            # another worker stores its calendar while ours is being created
+            models.Student.objects.filter(userId=userId).update(calendarId="theirs")
+            return {"id": calendarId}
+
+        class RacingCalendars:
+            def insert(this, body):
+                return mock({"execute": lambda: store_first(0, "ours")})
+
+            def delete(this, calendarId):
+                self.deleted.append(calendarId)
+                return mock({"execute": lambda: None})
+
+        when(services.calendar_service).calendars().thenReturn(RacingCalendars())
+
+        self.assertTrue(tools.provision_calendar(0))
+        self.assertEquals(models.Student.objects.get(userId=0).calendarId, "theirs")
+        self.assertEquals(self.deleted, ["ours"])
+
+    def test_create_calendar_queued_once(self):
+        """
+        Tests that a pending calendar is not queued again on every page view, only once
+        its claim expired
+        """
+        user = test_utils.login(self)
+        queued = []
+        when(tools).run_in_background(tools.provision_calendar, any).thenAnswer(
+            lambda function, userId: queued.append(userId)
+        )
+
+        try:
+            get_response(self, "/")
+            get_response(self, "/")
+            self.assertEquals(queued, [user.id])
+
+            models.Student.objects.filter(userId=user.id).update(
+                calendar_claimed=datetime.now(tz=pytz.utc) - timedelta(hours=1)
+            )
+            get_response(self, "/")
+            self.assertEquals(queued, [user.id, user.id])
+        finally:
+            test_utils.logout(self, user)
+
+    def test_add_assignment_pending(self):
+        """
+        Tests that adding a personal assignment while the calendar is set up shows an error,
+        instead of redirecting as if it was added
+        """
+        user = test_utils.login(self)
+        models.Student.objects.filter(userId=user.id).update(calendar_pending=True)
+
+        try:
+            response = self.client.post(
+                reverse("add_assignment"),
+                data={
+                    "summary": "essay",
+                    "est_time": 1,
+                    "time_day": 1,
+                    "time_month": 1,
+                    "time_year": 2000,
+                },
+            )
+            self.assertContains(response, "Your calendar is being set up")
+            self.assertEquals(self.inserted, [])
+        finally:
+            test_utils.logout(self, user)
+
+    def test_calendar_view_pending(self):
+        """
+        Tests that the calendar page renders a placeholder while the calendar is created
+        """
+        models.Student.objects.filter(userId=0).delete()
+        user = test_utils.login(self)
+
+        try:
+            response = get_response(self, "/calendar/")
+            self.assertContains(response, "Your calendar is being set up")
+            self.assertTrue(models.Student.objects.get(userId=user.id).calendar_pending)
+            self.assertEquals(self.inserted, [])
+        finally:
+            test_utils.logout(self, user)
+
+
+class EmailServiceTests(TestCase):
+    def setUp(self):
+        from aiosmtpd.controller import Controller
+        from .email_service import EmailService
+
+        class Inbox:
+            def __init__(self):
+                self.messages = []
+                self.sessions = set()
+
+            async def handle_RCPT(self, server, session, envelope, address, options):
+                if address == "refused@test.com":
+                    return "550 No such user"
+                envelope.rcpt_tos.append(address)
+                return "250 OK"
+
+            async def handle_DATA(self, server, session, envelope):
+                self.messages.append(envelope)
+                self.sessions.add(id(session))
+                return "250 OK"
+
+        # a local smtp stand-in instead of gmail, on a free port
+        with socket.socket() as free:
+            free.bind(("127.0.0.1", 0))
+            port = free.getsockname()[1]
+        self.inbox = Inbox()
+        self.controller = Controller(self.inbox, hostname="127.0.0.1", port=port)
+        self.controller.start()
+
+        self.password = os.environ.pop("EMAIL_PASSWORD", None)
+        with self.settings(
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=port,
+            EMAIL_USE_TLS=False,
+            EMAIL_POOL_SIZE=3,
+        ):
+            self.email_service = EmailService()
+        self.temp_email_service = getattr(services, "email_service", None)
+        services.email_service = self.email_service
+
+    def tearDown(self):
+        self.email_service.pool.close()
+        self.controller.stop()
+        if self.password != None:
+            os.environ["EMAIL_PASSWORD"] = self.password
+        if self.temp_email_service == None:
+            del services.email_service
+        else:
+            services.email_service = self.temp_email_service
+
+    def test_send_all_messages_pooled(self):
+        """
+        Tests that the notification backlog is sent over at most EMAIL_POOL_SIZE connections
+        """
+        for i in range(12):
+            models.Notification.objects.create(email=f"{i}@test.com", text=f"text {i}")
+
+        with self.settings(EMAIL_POOL_SIZE=3):
+            tools.send_all_messages()
+
+        self.assertEquals(
+            sorted(envelope.rcpt_tos[0] for envelope in self.inbox.messages),
+            sorted(f"{i}@test.com" for i in range(12)),
+        )
+        self.assertTrue(len(self.inbox.sessions) <= 3)
+        self.assertEquals(models.Notification.objects.count(), 0)
+
+    def test_message_reconnects(self):
+        """
+        Tests that a pooled connection that died is replaced, without losing the message
+        """
+        connection = self.email_service.pool.acquire()
+        connection.close()
+        self.email_service.pool.release(connection)
+
+        self.email_service.message("text", "test@test.com", "subject")
+
+        self.assertEquals(len(self.inbox.messages), 1)
+
+    def test_refused_recipient_keeps_connection(self):
+        """
+        Tests that a message the server refuses is not sent again, and its connection is reused
+        """
+        import smtplib
+
+        pool = self.email_service.pool
+        [(connection, _)] = pool.idle
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            self.email_service.message("text", "refused@test.com", "subject")
+        self.assertEquals([idle for idle, _ in pool.idle], [connection])
+
+        self.email_service.message("text", "test@test.com", "subject")
+        self.assertEquals(len(self.inbox.messages), 1)
+        self.assertEquals([idle for idle, _ in pool.idle], [connection])
+
+    def test_pool_probes_idle_connections(self):
+        """
+        Tests that idle connections are checked with NOOP, and dead ones dropped
+        """
+        pool = self.email_service.pool
+        pool.keepalive = 0
+        alive = pool.acquire()
+        dead = pool.connect()
+        dead.close()
+        pool.release(alive)
+        pool.idle.append((dead, 0))
+
+        pool.probe()
+
+        self.assertEquals([connection for connection, _ in pool.idle], [alive])
+
+
+class NotificationQueueTests(TestCase):
+    def setUp(self):
+        test = self
+        self.sent = []
+
+        class Outbox:
+            def message(self, text, to, subject):
+                if to == "bad@test.com":
+                    raise ValueError("refused")
+                if to == "refused@test.com":
+                    raise smtplib.SMTPRecipientsRefused({to: (550, b"no such user")})
+                test.sent.append(to)
+
+        self.temp_email_service = getattr(services, "email_service", None)
+        services.email_service = Outbox()
+
+    def tearDown(self):
+        if self.temp_email_service == None:
+            del services.email_service
+        else:
+            services.email_service = self.temp_email_service
+
+    def test_send_all_messages_in_chunks(self):
+        """
+        Tests that the whole queue is sent, a chunk at a time, and then emptied
+        """
+        for i in range(5):
+            models.Notification.objects.create(email=f"{i}@test.com", text="text")
+
+        # claim, load and delete per chunk of 2, then a claim that comes back empty
+        with self.settings(NOTIFICATION_CHUNK_SIZE=2):
+            with self.assertNumQueries(3 * 3 + 2):
+                tools.send_all_messages()
+
+        self.assertEquals(sorted(self.sent), [f"{i}@test.com" for i in range(5)])
+        self.assertEquals(models.Notification.objects.count(), 0)
+
+    def test_send_all_messages_keeps_unsent(self):
+        """
+        Tests that only sent notifications are deleted when a send fails, and the rest is given back
+        """
+        models.Notification.objects.create(email="good@test.com", text="text")
+        models.Notification.objects.create(email="bad@test.com", text="text")
+
+        with self.assertRaises(ValueError):
+            tools.send_all_messages()
+
+        self.assertEquals(self.sent, ["good@test.com"])
+        notif = models.Notification.objects.get()
+        self.assertEquals((notif.email, notif.claim), ("bad@test.com", None))
+
+    def test_send_all_messages_after_failure(self):
+        """
+        Tests that the chunks after a failed send are still sent, before the error is raised
+        """
+        models.Notification.objects.create(email="bad@test.com", text="text")
+        for i in range(3):
+            models.Notification.objects.create(email=f"{i}@test.com", text="text")
+
+        with self.settings(NOTIFICATION_CHUNK_SIZE=1):
+            with self.assertRaises(ValueError):
+                tools.send_all_messages()
+
+        self.assertEquals(sorted(self.sent), [f"{i}@test.com" for i in range(3)])
+        self.assertEquals(models.Notification.objects.get().email, "bad@test.com")
+
+    def test_refused_notifications_dropped(self):
+        """
+        Tests that notifications for an address the server refuses are dropped, not retried
+        """
+        models.Notification.objects.create(email="refused@test.com", text="text")
+        models.Notification.objects.create(email="good@test.com", text="text")
+
+        tools.send_all_messages()
+
+        self.assertEquals(self.sent, ["good@test.com"])
+        self.assertEquals(models.Notification.objects.count(), 0)
+
+    def test_claimed_notifications_skipped(self):
+        """
+        Tests that notifications claimed by another worker are left to it, until its claim expires
+        """
+        now = datetime.now(tz=pytz.utc)
+        models.Notification.objects.create(
+            email="theirs@test.com", text="text", claim="other", claimed_at=now
+        )
+        models.Notification.objects.create(
+            email="stale@test.com",
+            text="text",
+            claim="dead",
+            claimed_at=now - timedelta(hours=1),
+        )
+        models.Notification.objects.create(email="new@test.com", text="text")
+
+        tools.send_all_messages()
+
+        self.assertEquals(sorted(self.sent), ["new@test.com", "stale@test.com"])
+        self.assertEquals(models.Notification.objects.get().email, "theirs@test.com")
+
+    def test_coalesced_per_address(self):
+        """
+        Tests that all pending notifications for an address are sent as one email
+        """
+        test = self
+        texts = {}
+
+        class Outbox:
+            def message(self, text, to, subject):
+                test.sent.append(to)
+                texts[to] = text
+
+        services.email_service = Outbox()
+        clazz = models.Class.objects.create(className="class name", professorId=0)
+        for i in range(2):
+            user = User.objects.create(username=f"user {i}", email=f"{i}@test.com")
+            models.Student.objects.create(
+                userId=user.id, name=f"student {i}", classes={clazz}
+            )
+        for assignment in ["One", "Two", "Three"]:
+            tools.notify_students_of_change("class name", assignment, "create")
+        models.Notification.objects.create(email="0@test.com", text="daily digest")
+
+        # a chunk is a number of addresses, not of notifications
+        with self.settings(NOTIFICATION_CHUNK_SIZE=1):
+            tools.send_all_messages()
+
+        self.assertEquals(sorted(self.sent), ["0@test.com", "1@test.com"])
+        self.assertEquals(models.Notification.objects.count(), 0)
+        text = texts["0@test.com"]
+        self.assertIn("Dear student 0,", text)
+        self.assertIn("3 assignments have been updated in your classes", text)
+        for assignment in ["One", "Two", "Three"]:
+            self.assertEquals(
+                text.count(f"Assignment '{assignment}' was created for class"), 1
+            )
+        self.assertIn("daily digest", text)
+        self.assertNotIn("daily digest", texts["1@test.com"])
+
+    def test_single_change_unchanged(self):
+        """
+        Tests that a lone change notification is sent as it was queued
+        """
+        models.Notification.objects.create(
+            email="0@test.com",
+            text=tools.change_text("student", ["change"]),
+            name="student",
+            change="change",
+        )
+        notif = models.Notification.objects.get()
+
+        self.assertEquals(
+            tools.coalesce_notifications([notif]), [("0@test.com", notif.text, [notif])]
+        )
+        self.assertIn("An assignment has been updated in one of your classes", notif.text)
+
+
+class BulkNotificationTests(TestCase):
+    def test_notify_students_of_change_bulk(self):
+        """
+        Tests that a whole class is notified with one query for the emails and one insert
+        """
+        clazz = models.Class.objects.create(className="class name", professorId=0)
+        for i in range(3):
+            user = User.objects.create(username=f"user {i}", email=f"{i}@test.com")
+            models.Student.objects.create(
+                userId=user.id, name=f"student {i}", classes={clazz}
+            )
+        # a student without a user is skipped, and one in another class is not notified
+        models.Student.objects.create(userId=-1, name="no user", classes={clazz})
+        models.Student.objects.create(userId=user.id + 1, name="other class")
+
+        with self.assertNumQueries(2):
+            tools.notify_students_of_change("class name", "Assg", "change")
+
+        notifs = models.Notification.objects.order_by("email")
+        self.assertEquals(
+            [notif.email for notif in notifs], [f"{i}@test.com" for i in range(3)]
+        )
+        self.assertIn("Dear student 0,", notifs[0].text)
+        self.assertIn(
+            "Assignment 'Assg' was changed for class 'class name'", notifs[0].text
+        )
+
+    def test_run_in_background_after_commit(self):
+        """
+        Tests that background work only starts once the transaction commits
+        """
+        import threading
+
+        done = threading.Event()
+        with self.captureOnCommitCallbacks(execute=True):
+            tools.run_in_background(done.set)
+            self.assertFalse(done.is_set())
+
+        self.assertTrue(done.wait(5))
+
+
+class DailyDigestTests(TestCase):
+    def setUp(self):
+        self.fetched = []
+        # noon in new york, when every digest of the day is due
+        self.noon = pytz.timezone("America/New_York").localize(
+            datetime(year=2021, month=10, day=18, hour=12)
+        )
+
+        def fetch(calendarId, day, month, year, className=None, due_in=None):
+            self.fetched.append((calendarId, (year, month, day), str(due_in)))
+            event = create_date(name=f"due in {calendarId}")
+            event["className"] = className
+            return [event]
+
+        when(calendar_sync).sync_calendars(any).thenReturn(None)
+        when(tools).get_events_from_calendar(
+            any, day=any, month=any, year=any, className=any, due_in=any
+        ).thenAnswer(fetch)
+
+        clazz = models.Class.objects.create(
+            className="class name", calendarId="class calendar", professorId=0
+        )
+        for i in range(3):
+            user = User.objects.create(username=f"user {i}", email=f"{i}@test.com")
+            models.Student.objects.create(
+                userId=user.id,
+                name=f"student {i}",
+                calendarId=f"personal {i}",
+                classes={clazz},
+            )
+
+    def tearDown(self):
+        unstub()
+
+    def test_class_calendar_fetched_once(self):
+        """
+        Tests that a class calendar is fetched once, not once per student taking the class
+        """
+        tools.notify_students_of_today_assignments(now=self.noon)
+
+        self.assertEquals(
+            sorted(calendarId for calendarId, _, _ in self.fetched),
+            ["class calendar", "personal 0", "personal 1", "personal 2"],
+        )
+        notifs = models.Notification.objects.order_by("email")
+        self.assertEquals(
+            [notif.email for notif in notifs], [f"{i}@test.com" for i in range(3)]
+        )
+        self.assertIn("Dear student 0,", notifs[0].text)
+        self.assertIn(
+            "For class name:<br>&emsp;due in class calendar<br>", notifs[0].text
+        )
+        self.assertIn("For Personal:<br>&emsp;due in personal 0<br>", notifs[0].text)
+        self.assertNotIn("personal 1", notifs[0].text)
+
+    def test_once_a_day(self):
+        """
+        Tests that a student gets one digest a day, however often the job runs
+        """
+        tools.notify_students_of_today_assignments(now=self.noon)
+        tools.notify_students_of_today_assignments(now=self.noon)
+        self.assertEquals(models.Notification.objects.count(), 3)
+
+        tools.notify_students_of_today_assignments(now=self.noon + timedelta(days=1))
+        self.assertEquals(models.Notification.objects.count(), 6)
+
+    def test_failed_run_retried(self):
+        """
+        Tests that students whose digest failed to be queued are still due on the next run
+        """
+        when(calendar_sync).sync_calendars(any).thenRaise(TimeoutError)
+        with self.assertRaises(TimeoutError):
+            tools.notify_students_of_today_assignments(now=self.noon)
+        self.assertFalse(models.Student.objects.exclude(digest_sent_on=None).exists())
+
+        when(calendar_sync).sync_calendars(any).thenReturn(None)
+        tools.notify_students_of_today_assignments(now=self.noon)
+        self.assertEquals(models.Notification.objects.count(), 3)
+
+    def test_sync_outside_transaction(self):
+        """
+        Tests that calendars are synced before the transaction queueing the digests is opened
+        """
+        from django.db import connection
+
+        depth = len(connection.savepoint_ids)
+        synced = []
+        when(calendar_sync).sync_calendars(any).thenAnswer(
+            lambda calendarIds: synced.append(len(connection.savepoint_ids))
+        )
+
+        tools.notify_students_of_today_assignments(now=self.noon)
+
+        self.assertEquals(synced, [depth])
+        self.assertEquals(models.Notification.objects.count(), 3)
+
+    def test_buckets(self):
+        """
+        Tests that the students of a time zone are let in one bucket per run
+        """
+        one_am = self.noon.replace(hour=1)
+        ids = list(models.Student.objects.order_by("id").values_list("id", flat=True))
+
+        with self.settings(DIGEST_HOUR=1, DIGEST_BUCKET_MINUTES=10):
+            tools.notify_students_of_today_assignments(now=one_am - timedelta(minutes=1))
+            self.assertEquals(models.Notification.objects.count(), 0)
+
+            tools.notify_students_of_today_assignments(now=one_am)
+            self.assertEquals(
+                models.Notification.objects.count(),
+                len([id for id in ids if id % 6 == 0]),
+            )
+
+            tools.notify_students_of_today_assignments(now=one_am + timedelta(hours=1))
+            self.assertEquals(models.Notification.objects.count(), 3)
+
+    def test_timezone(self):
+        """
+        Tests that digests go out by the local time, and for the local date, of each student
+        """
+        models.Student.objects.update(digest_sent_on=self.noon.date())
+        models.Student.objects.filter(name="student 0").update(timezone="Asia/Tokyo")
+        # 20:00 in new york is 09:00 of the next day in tokyo
+        evening = self.noon.replace(hour=20)
+
+        with self.settings(DIGEST_HOUR=1, DIGEST_BUCKET_MINUTES=60):
+            tools.notify_students_of_today_assignments(now=evening)
+
+        self.assertEquals(
+            list(models.Notification.objects.values_list("email", flat=True)),
+            ["0@test.com"],
+        )
+        self.assertIn(
+            ("personal 0", (2021, 10, 19), "Asia/Tokyo"), self.fetched,
+        )
+        self.assertEquals(
+            models.Student.objects.get(name="student 0").digest_sent_on,
+            datetime(year=2021, month=10, day=19).date(),
+        )
+
+    def test_due_date_from_store(self):
+        """
+        Tests that an assignment is in the digest of the local day it is due, as stored by
+        create_event, like the calendar and the todo list show it
+        """
+        unstub()
+        due = pytz.utc.localize(datetime(year=2021, month=10, day=21))
+        event = tools.event_body("Essay", "", due)
+        event["id"] = "essay"
+        calendar_sync.store_event("class calendar", event)
+        # everything was just synced, so nothing is asked from the api
+        for calendarId in ["class calendar", "personal 0", "personal 1", "personal 2"]:
+            models.CalendarSyncState.objects.create(
+                calendarId=calendarId, synced_at=datetime.now(tz=pytz.utc)
+            )
+
+        zone = pytz.timezone("America/New_York")
+        with self.settings(DIGEST_HOUR=1, DIGEST_BUCKET_MINUTES=60):
+            for day in [20, 21, 22]:
+                tools.notify_students_of_today_assignments(
+                    now=zone.localize(datetime(year=2021, month=10, day=day, hour=2))
+                )
+                if day == 20:
+                    self.assertEquals(models.Notification.objects.count(), 0)
+
+        notifs = models.Notification.objects.all()
+        self.assertEquals(len(notifs), 3)
+        self.assertIn("&emsp;Essay<br>", notifs[0].text)
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        from .scheduler import Scheduler
+
+        self.now = datetime(year=2021, month=10, day=18, tzinfo=pytz.utc)
+        self.runs = []
+        self.scheduler = Scheduler(lease=60, max_retries=2, backoff=30)
+        self.scheduler.every(600, "job", lambda: self.runs.append("job"))
+
+    def test_runs_when_due(self):
+        """
+        Tests that a new job runs right away, and then every interval
+        """
+        self.assertEquals(self.scheduler.run_pending(now=self.now), ["job"])
+        self.assertEquals(
+            self.scheduler.run_pending(now=self.now + timedelta(seconds=599)), []
+        )
+        self.assertEquals(
+            self.scheduler.run_pending(now=self.now + timedelta(seconds=600)), ["job"]
+        )
+        stats = self.scheduler.stats()["job"]
+        self.assertEquals(stats["runs"], 2)
+        self.assertEquals(stats["next_run_at"], self.now + timedelta(seconds=1200))
+        self.assertGreaterEqual(stats["max_duration"], stats["mean_duration"])
+
+    def test_catch_up(self):
+        """
+        Tests that runs missed while no worker was up are made up for with one run
+        """
+        self.scheduler.run_pending(now=self.now)
+        later = self.now + timedelta(hours=5)
+
+        self.assertEquals(self.scheduler.run_pending(now=later), ["job"])
+        self.assertEquals(self.scheduler.run_pending(now=later), [])
+        self.assertEquals(
+            models.ScheduledJob.objects.get(name="job").next_run_at,
+            later + timedelta(seconds=600),
+        )
+
+    def test_retries_with_backoff(self):
+        """
+        Tests that a failing job is retried with growing delays, then waits for its next run
+        """
+
+        def fail():
+            self.runs.append("fail")
+            raise ValueError("broken")
+
+        self.scheduler.every(600, "job", fail)
+
+        self.scheduler.run_pending(now=self.now)
+        job = models.ScheduledJob.objects.get(name="job")
+        self.assertEquals(job.failures, 1)
+        self.assertIn("ValueError: broken", job.last_error)
+        self.assertEquals(job.next_run_at, self.now + timedelta(seconds=30))
+
+        retry = self.now + timedelta(seconds=30)
+        self.scheduler.run_pending(now=retry)
+        self.assertEquals(
+            models.ScheduledJob.objects.get(name="job").next_run_at,
+            retry + timedelta(seconds=60),
+        )
+
+        # out of retries
+        retry = retry + timedelta(seconds=60)
+        self.scheduler.run_pending(now=retry)
+        job = models.ScheduledJob.objects.get(name="job")
+        self.assertEquals(job.failures, 0)
+        self.assertEquals(job.next_run_at, retry + timedelta(seconds=600))
+        self.assertEquals(self.runs, ["fail"] * 3)
+
+    def test_leader_lock(self):
+        """
+        Tests that only one worker runs jobs, until its lock expires
+        """
+        from .scheduler import Scheduler
+
+        other = Scheduler(lease=60)
+        other.every(600, "job", lambda: self.runs.append("other"))
+
+        self.assertEquals(self.scheduler.run_pending(now=self.now), ["job"])
+        later = self.now + timedelta(seconds=600)
+        self.assertEquals(other.run_pending(now=later), [])
+
+        # the leader went away
+        models.SchedulerLock.objects.update(expires_at=self.now)
+        self.assertEquals(other.run_pending(now=later), ["job"])
+        self.assertEquals(self.runs, ["job", "other"])
+
+        other.resign()
+        self.assertFalse(models.SchedulerLock.objects.exists())
+
+
+class WakeupTests(TestCase):
+    def setUp(self):
+        from .wakeup import Listener
+
+        self.listener = Listener()
+        # forget wakeups left over by other tests
+        self.listener.wait(0)
+
+    def test_wakes_on_commit(self):
+        """
+        Tests that queueing a notification wakes the listener up, once it is committed
+        """
+        user = User.objects.create(username="user", email="user@test.com")
+        self.assertFalse(self.listener.wait(0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tools.send_message(user.id, "text")
+            self.assertFalse(self.listener.wait(0))
+
+        self.assertTrue(self.listener.wait(0))
+        # one wakeup per batch of notifications
+        self.assertFalse(self.listener.wait(0))
+
+    def test_wakes_waiting_thread(self):
+        """
+        Tests that a listener sleeping in another thread is woken up right away
+        """
+        import threading
+        import time
+
+        woken = []
+        waiting = threading.Thread(target=lambda: woken.append(self.listener.wait(30)))
+        started = time.monotonic()
+        waiting.start()
+
+        clazz = models.Class.objects.create(className="class name", professorId=0)
+        user = User.objects.create(username="user", email="user@test.com")
+        models.Student.objects.create(userId=user.id, name="student", classes={clazz})
+        with self.captureOnCommitCallbacks(execute=True):
+            tools.notify_students_of_change("class name", "Assg", "change")
+
+        waiting.join(5)
+        self.assertEquals(woken, [True])
+        self.assertLess(time.monotonic() - started, 5)
@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+from django.core.cache import caches
+
+
+class TieredCache:
+    """
+    Base of the caches in front of calendar data (see EventCache and FragmentCache).
+    There are two tiers: an in-process LRU, and (optionally) a django cache backend
+    that is shared between every web worker. A ttl of 0 turns the cache off.
+    Keys are strings or tuples, and name their entry in the shared tier after prefix
+    """
+
+    prefix = "cache"
+
+    def __init__(self, ttl=300, max_entries=512, backend=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (expires at, value)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def shared(self):
+        """
+        Returns the django cache used as the shared tier, or None if there is none
+        """
+        if self.backend == None:
+            return None
+        return caches[self.backend]
+
+    def shared_key(self, key):
+        """
+        Returns the name of key in the shared tier
+        """
+        parts = key if isinstance(key, tuple) else (key,)
+        return ":".join([self.prefix] + [str(part) for part in parts])
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None if it is not cached
+        """
+        if self.ttl <= 0:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry != None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+
+        shared = self.shared()
+        if shared != None:
+            value = shared.get(self.shared_key(key))
+            if value != None:
+                self.store(key, value)
+                with self.lock:
+                    self.hits += 1
+                return value
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """
+        Caches value under key
+        """
+        if self.ttl <= 0:
+            return
+
+        self.store(key, value)
+        shared = self.shared()
+        if shared != None:
+            shared.set(self.shared_key(key), value, timeout=self.ttl)
+
+    def store(self, key, value):
+        """
+        Puts value into the in-process tier, evicting the least recently used entries if it is full
+        """
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def drop(self, matches):
+        """
+        Drops the entries of the in-process tier whose key matches (a function of the key)
+        """
+        with self.lock:
+            for key in [key for key in self.entries if matches(key)]:
+                del self.entries[key]
+
+    def increment(self, counter):
+        """
+        Moves a counter in the shared tier (a version that is part of other keys) to a new value
+        """
+        shared = self.shared()
+        if shared == None:
+            return
+        shared.add(counter, 0, timeout=None)
+        try:
+            shared.incr(counter)
+        except ValueError:
+            # the counter expired between add and incr, any new value is fine
+            shared.set(counter, 1, timeout=None)
+
+    def clear(self):
+        """
+        Drops everything in the in-process tier and resets the counters
+        """
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """
+        Returns hit/miss/eviction counters, so the cache can be sized
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "hit_ratio": 0 if lookups == 0 else self.hits / lookups,
+            }
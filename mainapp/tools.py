@@ -1,20 +1,48 @@
 import pytz
 from . import services
 from . import models
+from . import calendar_sync
+from . import batching
+from . import wakeup
+from . import email_service
+from .middleware import IdentityMap, current_identity_map
 import datetime
 import logging
+import codecs
+import csv
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models import F, Min, OuterRef, Q, Subquery
 from django.template import Context, Template
+from django.template.loader import get_template
 
 # calendar api query documentation : https://developers.google.com/calendar/api
 
 logger = logging.getLogger(__name__)
 
 
+def request_identity_map(request):
+    """
+    Returns the identity map IdentityMapMiddleware attached to this request, or None
+    (requests built by hand, e.g. in tests, do not have one)
+    """
+    identity_map = getattr(request, "identity_map", None)
+    if isinstance(identity_map, IdentityMap) and identity_map.userId == request.user.id:
+        return identity_map
+    return None
+
+
 def get_student(request):
     """
     Gets the student model that corresponds to the user id for the current request
     """
+    identity_map = request_identity_map(request)
+    if identity_map != None:
+        return identity_map.student()
     return models.Student.objects.filter(userId=request.user.id).first()
 
 
@@ -22,6 +50,9 @@ def get_class(className):
     """
     Gets the class that corresponds to the class name
     """
+    identity_map = current_identity_map.get()
+    if identity_map != None:
+        return identity_map.clazz(className)
     return models.Class.objects.filter(className=className).first()
 
 
@@ -29,6 +60,9 @@ def class_exists(className):
     """
     Returns whether or not a class exists with a certain class name
     """
+    identity_map = current_identity_map.get()
+    if identity_map != None:
+        return identity_map.clazz(className) != None
     return 0 != models.Class.objects.filter(className=className).count()
 
 
@@ -63,24 +97,34 @@ def student_exists(request):
     """
     Determines if there is a student with an id tied to this request
     """
-    return (
-        request.user.id != None
-        and models.Student.objects.filter(userId=request.user.id).count() != 0
-    )
+    if request.user.id == None:
+        return False
+    identity_map = request_identity_map(request)
+    if identity_map != None:
+        return identity_map.student() != None
+    return models.Student.objects.filter(userId=request.user.id).count() != 0
 
 
 def initialize_user(request):
     """
     Initializes the current user if they are not currently initialized
+    Two first requests of a new user (a page and its favicon) can both get here, so the
+    student is created with get_or_create, which picks up the other request's student
     """
     if not request.user.id == None and not student_exists(request):
-        models.Student.objects.create(
+        student, created = models.Student.objects.get_or_create(
             userId=request.user.id,
-            classes=set(),
-            name=request.user.username,
-            class_colors=dict(),
+            defaults={
+                "classes": set(),
+                "name": request.user.username,
+                "class_colors": dict(),
+            },
         )
-        print("Initialized new student")
+        identity_map = request_identity_map(request)
+        if identity_map != None:
+            identity_map.loaded_student = student
+        if created:
+            print("Initialized new student")
     else:
         print(
             "Student is either already addressed with system or they are the null user"
@@ -90,13 +134,14 @@ def initialize_user(request):
 def create_event(request, summary, description, time, className=None):
     """
     Creates an event for the current users calendar given a summary (string) description (string representation of an int) and time (datetime object, not localized)
-    If calendar does not exist, do nothing
+    If calendar does not exist (or is still being set up, see calendar_pending), do nothing
+    Returns whether the event was created
     """
     create_calendar(request)
     time = pytz.utc.localize(time)
     if not calendar_exists(request):
         print("Invalid user to create event")
-        return
+        return False
     print("Creating event")
 
     if className == None:
@@ -106,18 +151,52 @@ def create_event(request, summary, description, time, className=None):
 
     event = (
         services.calendar_service.events()
-        .insert(
-            calendarId=calendarId,
-            body={
-                "summary": summary,
-                "description": description,
-                "start": {"dateTime": time.isoformat()},
-                "end": {"dateTime": (time + datetime.timedelta(days=1)).isoformat()},
-            },
-        )
+        .insert(calendarId=calendarId, body=event_body(summary, description, time))
         .execute()
     )
+    calendar_sync.store_event(calendarId, event)
+    calendar_changed(calendarId)
     print("Event created for user")
+    return True
+
+
+def calendar_changed(calendarId):
+    """
+    Drops cached events of a calendar, and everything that was rendered from them
+    Called whenever we write to a calendar (or a sync pulls in changes)
+    """
+    services.event_cache.invalidate(calendarId)
+    services.fragment_cache.bump(f"calendar:{calendarId}")
+
+
+def event_body(summary, description, time):
+    """
+    Returns the api representation of an assignment due at time (a localized datetime object)
+    """
+    return {
+        "summary": summary,
+        "description": description,
+        "start": {"dateTime": time.isoformat()},
+        "end": {"dateTime": (time + datetime.timedelta(days=1)).isoformat()},
+    }
+
+
+def insert_events(calendarId, bodies):
+    """
+    Inserts many events (see event_body) into calendar calendarId, in batched api calls
+    Returns a list of (created event, exception) in the same order as bodies
+    """
+    results = batching.execute_batched(
+        [
+            services.calendar_service.events().insert(calendarId=calendarId, body=body)
+            for body in bodies
+        ]
+    )
+    for event, error in results:
+        if error == None:
+            calendar_sync.store_event(calendarId, event)
+    calendar_changed(calendarId)
+    return results
 
 
 def delete_event(request, id, clazz):
@@ -142,87 +221,227 @@ def delete_event(request, id, clazz):
     services.calendar_service.events().delete(
         calendarId=calendarId, eventId=id
     ).execute()
+    calendar_sync.forget_event(calendarId, id)
+    calendar_changed(calendarId)
 
 
-def create_calendar(request):
+# work done off the request path, like creating calendars and queueing notifications
+background_executor = ThreadPoolExecutor(max_workers=2)
+
+
+def run_in_background(function, *args):
     """
-    Create a calendar for the user querying the request, if they do not already have one
+    Runs function(*args) on background_executor once the current transaction commits, so the
+    request does not wait for it (and function sees everything the request wrote)
+    Nobody waits for the result, so failures are only printed
     """
 
+    def run():
+        try:
+            function(*args)
+        except:
+            import traceback
+
+            traceback.print_exc()
+            print(f"Background {function.__name__}{args} failed")
+        finally:
+            # database connections are per thread, so close the one this thread opened
+            connections.close_all()
+
+    transaction.on_commit(lambda: background_executor.submit(run))
+
+
+def create_calendar(request):
+    """
+    Makes sure the user querying the request gets a calendar, without waiting on google for it
+    If they do not have one yet, their student is marked pending and provision_calendar creates
+    it in the background once the current transaction commits. Pages can check
+    calendar_pending(request) to show a placeholder in the meantime
+    """
     if calendar_exists(request):
-        print(
-            "Cannot create calendar for this user. Either null, or they have a calendar"
-        )
         return
 
     if request.user.id == None:
         print("Cannot create calendar for null user")
         return
+
+    student = get_student(request)
+    if student == None:
+        print("Cannot create calendar for a user without a student")
+        return
+    # queued or being created, unless whoever claimed it seems to have died. Without a claim
+    # it is still queued, or its creation failed and provision_pending_calendars retries it
+    if student.calendar_pending and (
+        student.calendar_claimed == None or not claim_expired(student.calendar_claimed)
+    ):
+        return
+
+    print("Queueing calendar creation for new user...")
+    models.Student.objects.filter(pk=student.pk).update(calendar_pending=True)
+    student.calendar_pending = True
+    # if this fails it stays pending, for the next visit or provision_pending_calendars to retry
+    run_in_background(provision_calendar, student.userId)
+
+
+def claim_expired(claimed):
+    """
+    Returns whether a calendar creation claimed at claimed (a datetime, or None) can be retried
+    """
+    lease = datetime.timedelta(
+        seconds=getattr(settings, "CALENDAR_PROVISION_LEASE", 60)
+    )
+    return claimed == None or claimed < datetime.datetime.now(tz=pytz.utc) - lease
+
+
+def provision_calendar(userId):
+    """
+    Creates the calendar of the student with userId, if they do not have one yet
+    Safe to retry and to run from several workers at once: the student is claimed first, and
+    only the first calendar stored for them is kept (any other one is deleted again)
+    Returns whether the student has a calendar afterwards
+    """
+    now = datetime.datetime.now(tz=pytz.utc)
+    lease = datetime.timedelta(
+        seconds=getattr(settings, "CALENDAR_PROVISION_LEASE", 60)
+    )
+    claimed = (
+        models.Student.objects.filter(userId=userId, calendarId="")
+        .filter(Q(calendar_claimed=None) | Q(calendar_claimed__lt=now - lease))
+        .update(calendar_claimed=now, calendar_pending=True)
+    )
+    if claimed == 0:
+        # it already has a calendar, or someone else is creating it right now
+        return (
+            models.Student.objects.filter(userId=userId).exclude(calendarId="").exists()
+        )
+
     print("Creating calendar for new user...")
     calendar = {
         "summary": "assignment organizer",
         "timeZone": "America/New_York",
     }
+    try:
+        created_calendar = (
+            services.calendar_service.calendars().insert(body=calendar).execute()
+        )
+    except:
+        # give the claim back, so a retry does not have to wait for it to expire
+        models.Student.objects.filter(userId=userId, calendar_claimed=now).update(
+            calendar_claimed=None
+        )
+        raise
 
-    # FIXME This try-catch will be ommitted until the exception type is found.
-    # if this throws an exception, please fill it in on 120
-    # having this try-catch without a specified exception breaks some tests
-    # try:
-    created_calendar = (
-        services.calendar_service.calendars().insert(body=calendar).execute()
+    stored = models.Student.objects.filter(userId=userId, calendarId="").update(
+        calendarId=created_calendar["id"], calendar_pending=False, calendar_claimed=None
     )
-    # except:
-    #     print("Calendar creation quota error")
-    #     return
-
-    # add the calendar to this student model
-    student = get_student(request)
-    student.calendarId = created_calendar["id"]
-    student.save()
+    if stored == 0:
+        # a worker whose claim had expired stored its calendar first, keep that one
+        services.calendar_service.calendars().delete(
+            calendarId=created_calendar["id"]
+        ).execute()
     print("Calendar created for a user")
+    return True
+
+
+def provision_pending_calendars():
+    """
+    Retries every calendar that is still pending. Run periodically by the worker
+    """
+    pending = models.Student.objects.filter(
+        calendar_pending=True, calendarId=""
+    ).values_list("userId", flat=True)
+    for userId in list(pending):
+        try:
+            provision_calendar(userId)
+        except:
+            import traceback
+
+            traceback.print_exc()
+            print(f"Failed to create calendar for userId {userId}")
+
+
+def calendar_pending(request):
+    """
+    Returns whether the calendar of the user querying the request is still being created
+    """
+    return (
+        student_exists(request)
+        and get_student(request).calendarId == ""
+        and get_student(request).calendar_pending
+    )
 
 
 def calendar_exists(request):
     return (
         request.user.id != None
-        and models.Student.objects.filter(userId=request.user.id).count() != 0
+        and student_exists(request)
         and get_student(request).calendarId != ""
     )
 
 
+def time_window(day=None, month=None, year=None):
+    """
+    Returns (timeMin, timeMax) utc datetimes covering the given day/month/year,
+    or (None, None) if they cannot be bounded (no year, or a day without a month)
+    Event times are in the calendar's time zone, so the window is padded by a day on
+    each side, and the exact day/month/year is checked afterwards
+    """
+    if year == None or (day != None and month == None):
+        return None, None
+
+    if month == None:
+        start = datetime.datetime(year, 1, 1)
+        end = datetime.datetime(year + 1, 1, 1)
+    elif day == None:
+        start = datetime.datetime(year, month, 1)
+        end = (start + datetime.timedelta(days=32)).replace(day=1)
+    else:
+        start = datetime.datetime(year, month, day)
+        end = start + datetime.timedelta(days=1)
+
+    start = pytz.utc.localize(start - datetime.timedelta(days=1))
+    end = pytz.utc.localize(end + datetime.timedelta(days=1))
+    return start, end
+
+
 def get_events_from_calendar(
-    calendarId, day=None, month=None, year=None, className=None
+    calendarId, day=None, month=None, year=None, className=None, due_in=None
 ):
     """
     Returns all events during specified day month year from calendar with calendarId
     If any of those are none, it does not filter. 
+    Dates are compared in the time zone of each event. With due_in (a pytz zone), they are
+    compared to the local date in due_in that an event is due instead, which is its end
+    (an assignment runs from its due date 00:00 UTC to a day later, see event_body)
     Also, will assign className className to each event, if specified
     This way, calendar view can determine a potential color code for classes
+    Events are read from the local event store (see calendar_sync), and listings are
+    served from services.event_cache when possible
     """
-    events = services.calendar_service.events().list(calendarId=calendarId).execute()
-    events = events["items"]
-
-    if day != None:
-        events = [
-            event
-            for event in events
-            if datetime.datetime.fromisoformat(event["start"]["dateTime"]).day == day
-        ]
-
-    if month != None:
-        events = [
-            event
-            for event in events
-            if datetime.datetime.fromisoformat(event["start"]["dateTime"]).month
-            == month
-        ]
-
-    if year != None:
-        events = [
-            event
-            for event in events
-            if datetime.datetime.fromisoformat(event["start"]["dateTime"]).year == year
-        ]
+    timeMin, timeMax = time_window(day, month, year)
+    window = None if timeMin == None else f"{timeMin.isoformat()}/{timeMax.isoformat()}"
+
+    events = services.event_cache.get(calendarId, window)
+    if events == None:
+        calendar_sync.sync_calendars([calendarId])
+        events = calendar_sync.stored_events(calendarId, timeMin, timeMax)
+        services.event_cache.set(calendarId, events, window)
+
+    if day != None or month != None or year != None:
+        filtered_events = []
+        for event in events:
+            start = datetime.datetime.fromisoformat(event["start"]["dateTime"])
+            if due_in != None:
+                # the calendar and the todo list show an assignment on the day it ends, too
+                start = datetime.datetime.fromisoformat(event["end"]["dateTime"])
+                start = start.astimezone(due_in)
+            if (
+                (day == None or start.day == day)
+                and (month == None or start.month == month)
+                and (year == None or start.year == year)
+            ):
+                filtered_events.append(event)
+        events = filtered_events
 
     for event in events:
         event["className"] = className
@@ -230,13 +449,53 @@ def get_events_from_calendar(
     return events
 
 
+def fetch_concurrently(calls, return_errors=False):
+    """
+    Runs every function in calls (no arguments) on a bounded thread pool
+    Returns their results in the same order as calls, so callers see the same output as a plain loop
+    At most settings.CALENDAR_FETCH_MAX_IN_FLIGHT run at once, and each one gets
+    settings.CALENDAR_FETCH_TIMEOUT seconds to finish
+    With return_errors, a call that fails or times out does not fail the others, and every
+    result is (result, None) or (None, error) instead
+    """
+    if len(calls) <= 1 and not return_errors:
+        return [call() for call in calls]
+
+    max_in_flight = getattr(settings, "CALENDAR_FETCH_MAX_IN_FLIGHT", 8)
+    timeout = getattr(settings, "CALENDAR_FETCH_TIMEOUT", 10)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_in_flight, len(calls))))
+    try:
+        futures = [executor.submit(call) for call in calls]
+        if not return_errors:
+            return [future.result(timeout=timeout) for future in futures]
+        results = []
+        for future in futures:
+            try:
+                results.append((future.result(timeout=timeout), None))
+            except Exception as e:
+                results.append((None, e))
+        return results
+    finally:
+        # do not hold the page hostage to a fetch that already timed out
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 def get_events_from_calendar_all_classes(student, day=None, month=None, year=None):
-    events = get_events_from_calendar(
-        student.calendarId, day=day, month=month, year=year,
-    )
+    """
+    Returns the events of the student's personal calendar followed by the events of each of their classes
+    All calendars are synced together first, so changes are fetched concurrently
+    """
+    calendar_sync.sync_calendars(student_calendars(student))
+
+    events = []
+    # the personal calendar might still be being created (see create_calendar)
+    if student.calendarId != "":
+        events = get_events_from_calendar(
+            student.calendarId, day=day, month=month, year=year,
+        )
 
     for clazz in student.classes:
-        print(clazz.className)
         events += get_events_from_calendar(
             clazz.calendarId,
             day=day,
@@ -247,6 +506,17 @@ def get_events_from_calendar_all_classes(student, day=None, month=None, year=Non
     return events
 
 
+def student_calendars(student):
+    """
+    Returns the calendarIds of the student's personal calendar and of all their classes
+    """
+    calendarIds = [clazz.calendarId for clazz in student.classes]
+    # the personal calendar might still be being created (see create_calendar)
+    if student.calendarId != "":
+        calendarIds.insert(0, student.calendarId)
+    return calendarIds
+
+
 def get_events(request, day=None, month=None, year=None):
     """
     Gets all events from a calendar associated with the user making the current request
@@ -274,14 +544,18 @@ def get_future_events(request, className=None):
         return []
 
     student = get_student(request)
-    calendarIds = [(student.calendarId, None)]
+    calendarIds = []
     if className != None:
-        calendarIds = []
         calendarIds.append((get_class(className).calendarId, className))
     else:
+        # the personal calendar might still be being created (see create_calendar)
+        if student.calendarId != "":
+            calendarIds.append((student.calendarId, None))
         for clazz in student.classes:
             calendarIds.append((clazz.calendarId, clazz.className))
 
+    calendar_sync.sync_calendars([calendarId for calendarId, name in calendarIds])
+
     events = []
     for calendarId, name in calendarIds:
         events += get_future_events_from_calendar(calendarId, name)
@@ -291,16 +565,21 @@ def get_future_events(request, className=None):
 
 def get_future_events_from_calendar(calendarId, className=None):
     """
-    Returns future events from a given calendar
+    Returns future events from a given calendar, read from the local event store
+    Everything from the start of today is cached, so the listing can be reused all day
     """
-    print(datetime.datetime.now().isoformat())
-    print(calendarId)
-    events = (
-        services.calendar_service.events()
-        .list(calendarId=calendarId, timeMin=datetime.datetime.now().isoformat() + "Z")
-        .execute()
-    )
-    events = events["items"]
+    now = datetime.datetime.now(tz=pytz.utc)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    window = f"future:{today.date().isoformat()}"
+
+    events = services.event_cache.get(calendarId, window)
+    if events == None:
+        calendar_sync.sync_calendars([calendarId])
+        events = calendar_sync.stored_events(calendarId, timeMin=today)
+        services.event_cache.set(calendarId, events, window)
+
+    # like the api, an event is in the future as long as it has not ended
+    events = [event for event in events if calendar_sync.parse_time(event["end"]) > now]
 
     for event in events:
         event["className"] = className
@@ -327,12 +606,16 @@ def add_class(request, className):
         print("Cannot add a class to a student that does not exist")
         return
 
+    clazz = get_class(className)
+    if clazz == None:
+        print("Cannot add a class that does not exist")
+        return
+
     student = get_student(request)
-    class_set = student.classes
-    class_colors = student.class_colors
-    class_set.add(get_class(className))
-    class_colors[get_class(className)] = "#0052bd"
-    student.save()
+    models.Enrollment.objects.update_or_create(
+        student=student, clazz=clazz, defaults={"color": "#0052bd"}
+    )
+    student.forget_enrollments()
 
 
 def remove_class(request, className):
@@ -344,9 +627,10 @@ def remove_class(request, className):
         return
 
     student = get_student(request)
-    class_set = student.classes
-    class_set.remove(get_class(className))
-    student.save()
+    models.Enrollment.objects.filter(
+        student=student, clazz__className=className
+    ).delete()
+    student.forget_enrollments()
 
 
 def is_professor(request):
@@ -398,31 +682,87 @@ def create_class(request, name, description):
     )
 
 
+def parse_syllabus(csv_file):
+    """
+    Reads an uploaded syllabus csv (name, YYYY-MM-DD, duration) one row at a time
+    Yields a dict for each non blank row, with an "error" if the row is invalid
+    """
+    rows = csv.reader(codecs.iterdecode(csv_file, "utf-8-sig"), skipinitialspace=True)
+    for line, row in enumerate(rows, start=1):
+        row = [field.strip() for field in row]
+        if not any(row):
+            continue
+        parsed = {"line": line, "name": "", "date": "", "duration": "", "error": None}
+        if len(row) < 3:
+            parsed["error"] = "expected: name, YYYY-MM-DD, duration"
+            yield parsed
+            continue
+        parsed["name"], parsed["date"], parsed["duration"] = row[0], row[1], row[2]
+        if parsed["name"] == "":
+            parsed["error"] = "missing assignment name"
+        else:
+            try:
+                parsed["time"] = pytz.utc.localize(
+                    datetime.datetime.strptime(parsed["date"], "%Y-%m-%d")
+                )
+            except ValueError:
+                parsed["error"] = f"invalid date '{parsed['date']}'"
+        yield parsed
+
+
 def upload_syllabus(request, form, className):
-    csv_file = request.FILES["file"].read().decode("utf-8")
-    line_count = 0
-    for line in csv_file.splitlines():
-        line = line.strip()
-        ls = line.split(",")
-        name = ls[0].strip()
-        date = ls[1].strip()
-        duration = ls[2].strip()
-        datetime_object = datetime.datetime.strptime(date, "%Y-%m-%d")
-        line_count += 1
-        create_event(request, name, duration, datetime_object, className)
-        logger.error(f"{name}, {date}, {duration}")
-    logger.error(f"Processed {line_count} lines.")
+    """
+    Adds every assignment in an uploaded syllabus csv (name, YYYY-MM-DD, duration) to the class calendar
+    All rows are validated before anything is created, then created in batched api calls
+    Returns a report dict with lists of "created", "failed" and "duplicated" rows
+    """
+    report = {"created": [], "failed": [], "duplicated": []}
+    calendarId = get_class(className).calendarId
+
+    # assignments already in the class calendar, or earlier in the file, are skipped
+    calendar_sync.sync_calendars([calendarId])
+    seen = {
+        (event.get("summary"), calendar_sync.parse_time(event["start"]))
+        for event in calendar_sync.stored_events(calendarId)
+    }
+
+    rows = []
+    for row in parse_syllabus(request.FILES["file"]):
+        if row["error"] != None:
+            report["failed"].append(row)
+        elif (row["name"], row["time"]) in seen:
+            report["duplicated"].append(row)
+        else:
+            seen.add((row["name"], row["time"]))
+            rows.append(row)
+
+    results = insert_events(
+        calendarId,
+        [event_body(row["name"], row["duration"], row["time"]) for row in rows],
+    )
+    for row, (event, error) in zip(rows, results):
+        if error != None:
+            row["error"] = str(error)
+            report["failed"].append(row)
+        else:
+            report["created"].append(row)
+
+    logger.info(
+        f"Syllabus for {className}: {len(report['created'])} created, "
+        f"{len(report['failed'])} failed, {len(report['duplicated'])} duplicated"
+    )
+    return report
 
 
 def send_message(userId, text):
     """
-    Adds an email to the message queue. Will be sent at a later time,
-    perhaps, every hour.
+    Adds an email to the message queue. The daemon is woken up to send it (see wakeup)
     """
     try:
         email = User.objects.filter(id=userId).first().email
         print("Model added")
         models.Notification.objects.create(email=email, text=text)
+        wakeup.notify()
     except:
         import traceback
 
@@ -430,90 +770,298 @@ def send_message(userId, text):
         print(f"Failed to send email to userId {userId}")
 
 
-def send_all_messages():
+def claim_notifications(limit):
     """
-    Sends out all messages defined in Notification objects
+    Claims the unsent notifications of up to limit email addresses for this worker, and
+    returns them. All notifications of an address are claimed together, so they can be sent
+    as one email (see coalesce_notifications)
+    A claim is a random token written onto the rows, so workers draining the queue at the same
+    time never get the same notifications. Claims older than settings.NOTIFICATION_CLAIM_LEASE
+    seconds (from a worker that died while sending) can be taken over
     """
+    now = datetime.datetime.now(tz=pytz.utc)
+    lease = datetime.timedelta(
+        seconds=getattr(settings, "NOTIFICATION_CLAIM_LEASE", 600)
+    )
+    claimable = Q(claimed_at=None) | Q(claimed_at__lt=now - lease)
+    claim = uuid.uuid4().hex
+
+    # the addresses that have waited longest
+    oldest = (
+        models.Notification.objects.filter(claimable)
+        .values("email")
+        .annotate(first=Min("id"))
+        .order_by("first")
+        .values("email")
+    )
+    # claimable is checked again by the update, in case another worker claimed some meanwhile
+    models.Notification.objects.filter(claimable, email__in=oldest[:limit]).update(
+        claim=claim, claimed_at=now
+    )
+    return list(models.Notification.objects.filter(claim=claim).order_by("id"))
 
-    notifs = models.Notification.objects.all()
 
-    print(f"Sending out {len(notifs)} emails...")
-    for notif in notifs.iterator():
-        services.email_service.message(
-            text=notif.text, to=notif.email, subject="Assignment Organizer"
-        )
+def coalesce_notifications(notifs):
+    """
+    Merges the notifications for each email address into one email
+    Returns (email, text, notifications merged into it) for every address, oldest first
+    Change notifications become one list of changes, anything else follows below it
+    """
+    by_email = {}
+    for notif in notifs:
+        by_email.setdefault(notif.email, []).append(notif)
+
+    messages = []
+    for email, group in by_email.items():
+        changes = [notif for notif in group if notif.change != None]
+        texts = [notif.text for notif in group if notif.change == None]
+        if len(changes) != 0:
+            # the same change can be queued twice (e.g. a form submitted twice)
+            lines = list(dict.fromkeys(notif.change for notif in changes))
+            texts.insert(0, change_text(changes[0].name, lines))
+        messages.append((email, "<br><hr><br>".join(texts), group))
+    return messages
 
-    models.Notification.objects.all().delete()
 
+def send_all_messages():
+    """
+    Sends out all messages defined in Notification objects, one email per address
+    The queue is drained settings.NOTIFICATION_CHUNK_SIZE addresses at a time, each chunk
+    is claimed first (see claim_notifications) and only what was actually sent is deleted.
+    Messages are sent settings.EMAIL_POOL_SIZE at a time, one per pooled smtp connection
+    Messages the server refuses for good are dropped. Any other failed send is given back once
+    the whole queue was tried, and the first such error is raised then
+    """
+    chunk_size = getattr(settings, "NOTIFICATION_CHUNK_SIZE", 100)
+    failed = []
+    error = None
+
+    try:
+        while True:
+            # failed notifications stay claimed until the end, so they are not claimed again
+            notifs = claim_notifications(chunk_size)
+            if len(notifs) == 0:
+                break
+
+            messages = coalesce_notifications(notifs)
+            print(
+                f"Sending out {len(messages)} emails for {len(notifs)} notifications..."
+            )
+            with ThreadPoolExecutor(
+                max_workers=getattr(settings, "EMAIL_POOL_SIZE", 4)
+            ) as executor:
+                sends = [
+                    executor.submit(
+                        services.email_service.message,
+                        text=text,
+                        to=email,
+                        subject="Assignment Organizer",
+                    )
+                    for email, text, _ in messages
+                ]
+
+            done = []
+            for (email, _, group), send in zip(messages, sends):
+                try:
+                    send.result()
+                    done += [notif.id for notif in group]
+                except Exception as e:
+                    if email_service.refused(e):
+                        print(f"Dropping notifications for {email}, refused: {e}")
+                        done += [notif.id for notif in group]
+                    else:
+                        failed += [notif.id for notif in group]
+                        error = e if error == None else error
+
+            models.Notification.objects.filter(id__in=done).delete()
+    finally:
+        if len(failed) != 0:
+            # let the next cycle (or another worker) try the rest right away
+            models.Notification.objects.filter(id__in=failed).update(
+                claim=None, claimed_at=None
+            )
+
+    if error != None:
+        raise error
     print("Email sending successful!")
 
 
 def get_all_students(className):
     """
     Returns a list of all students who have a class who's name is className
+    This is a single query on the (clazz, student) index of Enrollment, so it only
+    touches the students enrolled in the class, not every student
     """
-    ret = []
-
-    clazz = models.Class.objects.filter(className=className).first()
-    for student in models.Student.objects.all().iterator():
-        if clazz in student.classes:
-            ret.append(student)
-
-    return ret
+    return list(
+        models.Student.objects.filter(enrollments__clazz__className=className).order_by(
+            "id"
+        )
+    )
 
 
 def notify_students_of_change(className, assignmentName, action):
     """
     Notifies all students of a className that an assignment has changed
+    The students and their emails are loaded in one query, and all notifications are
+    queued with one insert (see send_message for a single one)
     """
-    print(get_all_students(className))
-    for student in get_all_students(className):
-        send_message(
-            student.userId,
-            f"""
-Dear {student.name},<br>
+    emails = User.objects.filter(id=OuterRef("userId")).values("email")[:1]
+    recipients = (
+        models.Student.objects.filter(enrollments__clazz__className=className)
+        .annotate(email=Subquery(emails))
+        .values_list("name", "email")
+    )
+    change = f"Assignment '{assignmentName}' was {action}d for class '{className}'."
+    notifs = [
+        models.Notification(
+            email=email, text=change_text(name, [change]), name=name, change=change
+        )
+        for name, email in recipients
+        # like send_message, skip students without a user
+        if email != None
+    ]
+    models.Notification.objects.bulk_create(notifs, batch_size=500)
+    wakeup.notify()
+    print(f"Queued {len(notifs)} notifications for class {className}")
+
+
+def change_text(name, changes):
+    """
+    Returns the email telling a student about changes to assignments (one line per change)
+    """
+    if len(changes) == 1:
+        updated = "An assignment has been updated in one of your classes"
+    else:
+        updated = f"{len(changes)} assignments have been updated in your classes"
+    lines = "<br>\n".join(changes)
+    return f"""
+Dear {name},<br>
 <br>
-An assignment has been updated in one of your classes:<br>
+{updated}:<br>
 <br>
-Assignment '{assignmentName}' was {action}d for class '{className}'.<br>
+{lines}<br>
 <br>
 We hope you have a great day,<br>
 Assignment Organizer
-            """,
-        )
+            """
 
 
-def notify_students_of_today_assignments():
+def notify_students_of_today_assignments(now=None):
     """
-    Notifies all students of assignments marked as due today
+    Queues the daily digest of every student it is due for, once a day in their own time zone
+    Meant to run every settings.DIGEST_BUCKET_MINUTES minutes. From settings.DIGEST_HOUR local
+    time on, the students of a time zone are let in one bucket (id % buckets) per run, so the
+    digests of a time zone are spread over an hour instead of all being built at once
     """
-    now = datetime.datetime.now(tz=pytz.UTC)
+    if now == None:
+        now = datetime.datetime.now(tz=pytz.UTC)
+    hour = getattr(settings, "DIGEST_HOUR", 1)
+    bucket_minutes = getattr(settings, "DIGEST_BUCKET_MINUTES", 10)
+    buckets = max(1, 60 // bucket_minutes)
+
+    students = models.Student.objects.all()
+    for timezone in students.order_by().values_list("timezone", flat=True).distinct():
+        zone = pytz.timezone(timezone)
+        local = now.astimezone(zone)
+        # how many buckets of this time zone are due by now
+        passed = (local.hour * 60 + local.minute - hour * 60) // bucket_minutes
+        if passed < 0:
+            continue
+
+        due = students.filter(timezone=timezone).filter(
+            Q(digest_sent_on=None) | Q(digest_sent_on__lt=local.date())
+        )
+        if passed < buckets - 1:
+            due = due.annotate(bucket=F("id") % buckets).filter(bucket__lte=passed)
+        ids = list(due.values_list("id", flat=True))
+        if len(ids) == 0:
+            continue
+
+        queue_digests(models.Student.objects.filter(id__in=ids), local.date(), zone)
 
-    # this is to fix a weird date offset where dates are being reported as one day in advance
-    now = now - datetime.timedelta(days=1)
 
-    for student in models.Student.objects.all().iterator():
-        events = get_events_from_calendar_all_classes(
-            student, day=now.day, month=now.month, year=now.year
+def queue_digests(students, date, zone):
+    """
+    Queues the digest of assignments due on date (in time zone zone) for every student in students
+    Every calendar is synced and read once (a class calendar is not fetched again for each of
+    its students), then the digests are put together in memory and queued in bulk,
+    settings.DIGEST_CHUNK_SIZE students at a time, and the students are marked as sent
+    """
+    emails = User.objects.filter(id=OuterRef("userId")).values("email")[:1]
+    recipients = list(
+        students.annotate(email=Subquery(emails))
+        .order_by("id")
+        .values_list("id", "name", "calendarId", "email")
+    )
+
+    # className of every calendar, None for personal calendars
+    calendars = {}
+    for _, _, calendarId, _ in recipients:
+        if calendarId != "":
+            calendars[calendarId] = None
+    classes = {}
+    for student_id, className, calendarId in models.Enrollment.objects.filter(
+        student__in=students
+    ).values_list("student_id", "clazz__className", "clazz__calendarId"):
+        if calendarId != "":
+            classes.setdefault(student_id, []).append(calendarId)
+            calendars[calendarId] = className
+
+    calendar_sync.sync_calendars(list(calendars))
+    due_today = {
+        calendarId: get_events_from_calendar(
+            calendarId,
+            day=date.day,
+            month=date.month,
+            year=date.year,
+            className=className,
+            due_in=zone,
         )
-        if len(events) != 0:
-            print("Sending daily assignment update")
-            events.sort(
-                key=lambda x: "None" if x["className"] == None else x["className"]
+        for calendarId, className in calendars.items()
+    }
+    print(f"Read {len(due_today)} calendars for the daily digest of {zone} {date}")
+
+    notifs = []
+    for student_id, name, calendarId, email in recipients:
+        events = list(due_today.get(calendarId, []))
+        for classCalendarId in sorted(classes.get(student_id, [])):
+            events += due_today[classCalendarId]
+        # like send_message, skip students without a user
+        if len(events) != 0 and email != None:
+            notifs.append(
+                models.Notification(email=email, text=digest_text(name, events))
             )
-            last_class = events[0]["className"]
+
+    # the students are marked together with queueing their digests, so a run that fails is
+    # retried for everyone, and a run that went through is not sent again. Nothing slow
+    # (like syncing calendars) happens in here, so the transaction stays short
+    chunk_size = getattr(settings, "DIGEST_CHUNK_SIZE", 500)
+    with transaction.atomic():
+        for start in range(0, len(notifs), chunk_size):
+            models.Notification.objects.bulk_create(notifs[start : start + chunk_size])
+        students.update(digest_sent_on=date)
+        wakeup.notify()
+    print(f"Sending daily assignment update to {len(notifs)} students")
+
+
+def digest_text(name, events):
+    """
+    Returns the daily digest email listing events (due today), grouped by class
+    """
+    events = sorted(
+        events, key=lambda x: "None" if x["className"] == None else x["className"]
+    )
+    last_class = events[0]["className"]
+    last_class_str = "Personal" if last_class == None else last_class
+    event_string = f"For {last_class_str}:<br>"
+    for event in events:
+        if last_class != event["className"]:
+            last_class = event["className"]
             last_class_str = "Personal" if last_class == None else last_class
-            event_string = f"For {last_class_str}:<br>"
-            for event in events:
-                if last_class != event["className"]:
-                    last_class = event["className"]
-                    last_class_str = "Personal" if last_class == None else last_class
-                    event_string += f"For {last_class_str}:<br>"
-                event_string += f"&emsp;{event['summary']}<br>"
-            send_message(
-                student.userId,
-                f"""
-Dear {student.name},<br>
+            event_string += f"For {last_class_str}:<br>"
+        event_string += f"&emsp;{event['summary']}<br>"
+    return f"""
+Dear {name},<br>
 <br>
 You have some assignments due today:<br>
 <br>
@@ -521,8 +1069,7 @@ You have some assignments due today:<br>
 <br>
 Good luck on your classes,<br>
 Assignment Organizer
-            """,
-            )
+            """
 
 
 def get_argv():
@@ -536,12 +1083,16 @@ def set_class_color(request, className, color):
     Sets the color of the class with class name to the user belonging to request with new color
     """
     student = get_student(request)
+    print("Saving color", color, "for class", className)
     if className == None:
         student.color = color
+        student.save()
     else:
-        student.class_colors[get_class(className)] = color
-    print("Saving color", color, "for class", className)
-    student.save()
+        models.Enrollment.objects.filter(
+            student=student, clazz__className=className
+        ).update(color=color)
+        student.forget_enrollments()
+    student_changed(request)
 
 
 def get_color(request, className=None):
@@ -588,17 +1139,30 @@ def days_until(date_string):
         return f"Due in {diff.days + 1} Days"
 
 
-def is_checked_off(request, event_id, className):
+def get_checked_off(request):
     """
-    Determines if a student checked off this assignment, signifying they have completed it
+    Returns the set of (className, eventId) pairs the student checked off, in a single query
+    The set is kept on the request's identity map, so it is only loaded once per request
     """
-    student_id = get_student(request).userId
-    return (
+    identity_map = request_identity_map(request)
+    if identity_map != None and identity_map.checked_off != None:
+        return identity_map.checked_off
+
+    checked_off = set(
         models.CheckedAssignments.objects.filter(
-            userId=student_id, className=className, eventId=event_id
-        ).count()
-        != 0
+            userId=get_student(request).userId
+        ).values_list("className", "eventId")
     )
+    if identity_map != None:
+        identity_map.checked_off = checked_off
+    return checked_off
+
+
+def is_checked_off(request, event_id, className):
+    """
+    Determines if a student checked off this assignment, signifying they have completed it
+    """
+    return (str(className), str(event_id)) in get_checked_off(request)
 
 
 def todo_list(request, className=None, editable=False, todo_loc=False):
@@ -611,37 +1175,122 @@ def todo_list(request, className=None, editable=False, todo_loc=False):
     """
     if not student_exists(request):
         return None
-    events = get_future_events(request, className)
-    ret = ""
-    for i, event in enumerate(events):
-
-        ret += f"""
-        <div class="container" style="border-radius:80px; background-color:{get_color(request, event['className'])};
-        font-size:20px; color:{"white" if not is_checked_off(request, event['id'], str(event['className'])) else "gray"}; padding-left:5%; margin-bottom: 10px;">
-        <div class="item" style="width:30%; left:10px;overflow-wrap: break-word;">{event['summary']}</div>"""
-        if className == None:
-            ret += f"""
-            <div style="text-align:center;" class="item">{event['className'] if str(event['className']) != "None" else "Personal"}</div><div></div>"""
-        ret += f"""
-        <div class="item" style="padding-right:5%;width:30%;text-align:right;">{days_until(event['end']['dateTime'])}</div>
-        """
+    # the list says how many days are left, so it can only be reused for the rest of today
+    return cached_fragment(
+        request,
+        ("todo", className, editable, todo_loc, datetime.date.today()),
+        lambda: render_todo_list(
+            request,
+            get_future_events(request, className),
+            className,
+            editable,
+            todo_loc,
+        ),
+        className=className,
+    )
+
+
+def cached_fragment(request, parts, render, className=None):
+    """
+    Returns render() (some HTML for the student of request), from services.fragment_cache if possible
+    The fragment is rendered from the calendar of className, or from all calendars of the student
+    if className is None. parts tells apart the fragments rendered from the same calendars
+    The key has the version stamps of those calendars and of the student, and the student's
+    colors, so any change to them renders the fragment again
+    """
+    cache = services.fragment_cache
+    if cache.ttl <= 0 or not student_exists(request):
+        return render()
+
+    student = get_student(request)
+    if className == None:
+        calendarIds = sorted(
+            str(calendarId) for calendarId in student_calendars(student)
+        )
+    else:
+        calendarIds = [str(get_class(className).calendarId)]
+    names = [f"calendar:{calendarId}" for calendarId in calendarIds]
+    names.append(f"student:{student.userId}")
+    colors = sorted(
+        (clazz.className, color) for clazz, color in student.class_colors.items()
+    )
+    key = cache.key(
+        student.userId,
+        parts,
+        list(zip(names, cache.stamps(*names))),
+        student.color,
+        colors,
+    )
+
+    html = cache.get(key)
+    if html == None:
+        html = render()
+        cache.set(key, html)
+    return html
+
+
+def student_changed(request):
+    """
+    Drops every fragment rendered for the student of request (after a check off or color change)
+    """
+    services.fragment_cache.bump(f"student:{get_student(request).userId}")
+
+
+@lru_cache(maxsize=None)
+def todo_template():
+    """
+    Returns the compiled todo list template (compiled once per process, even with DEBUG on)
+    """
+    return get_template("mainapp/todo_rows.html")
+
+
+def todo_rows(request, events, editable=False, todo_loc=False):
+    """
+    Returns one dict per event with everything the todo list template needs
+    Colors and professor rights are looked up once per class before the loop,
+    so building the rows does not touch the database
+    """
+    checked_off = get_checked_off(request)
+    classNames = {event["className"] for event in events}
+    colors = {name: get_color(request, name) for name in classNames}
+    professor = (
+        {name: is_professor_for_class(request, name) for name in classNames}
+        if editable
+        else {}
+    )
 
+    rows = []
+    for event in events:
+        eventClass = event["className"]
+        url = None
         if editable and todo_loc:
-            ret += f"""<a href="{event['className']}/{event['id']}/delete_assignment/">
-            """
+            url = f"{eventClass}/{event['id']}/delete_assignment/"
         elif editable:
-            ret += f"""<a href="{event['id']}/delete_assignment/">
-            """
+            url = f"{event['id']}/delete_assignment/"
+        rows.append(
+            {
+                "summary": event["summary"],
+                "label": eventClass if str(eventClass) != "None" else "Personal",
+                "due": days_until(event["end"]["dateTime"]),
+                "color": colors[eventClass],
+                "checked": (str(eventClass), str(event["id"])) in checked_off,
+                "url": url,
+                "deletable": editable and professor[eventClass],
+            }
+        )
+    return rows
 
-        if editable and not (is_professor_for_class(request, event["className"])):
-            ret += f"""<button style="right:-190px; border-radius:80px;color:white;
-            background-color:green; border:none;height:30px;width:180px;font-size:20px;position:absolute;"><i class='bx bx-check-square'></i> Check Off</button></a>"""
 
-        elif editable:
-            ret += f"""<button style="right:-190px; border-radius:80px;color:white;
-            background-color:red; border:none; height:30px;width:180px;font-size:20px;position:absolute;"><i class='bx bx-trash'></i>    Delete</button></a>"""
-        ret += "</div>"
-    return ret
+def render_todo_list(request, events, className=None, editable=False, todo_loc=False):
+    """
+    Renders events as a todo list (see todo_list)
+    """
+    return todo_template().render(
+        {
+            "rows": todo_rows(request, events, editable, todo_loc),
+            "show_class": className == None,
+        }
+    )
 
 
 def check_off(request, event_id, className):
@@ -649,12 +1298,23 @@ def check_off(request, event_id, className):
     Checks off assignment with event id and classname for the student
     """
     student_id = get_student(request).userId
-    if is_checked_off(request, event_id, className):
-        models.CheckedAssignments.objects.filter(
-            userId=student_id, className=className, eventId=event_id
-        ).delete()
-        return
-    models.CheckedAssignments.objects.create(
+    # if it was checked off, unchecking it is the delete. otherwise check it off
+    deleted, _ = models.CheckedAssignments.objects.filter(
         userId=student_id, className=className, eventId=event_id
-    )
+    ).delete()
+    if deleted == 0:
+        # ignore_conflicts, in case the same assignment is checked off twice at once
+        models.CheckedAssignments.objects.bulk_create(
+            [
+                models.CheckedAssignments(
+                    userId=student_id, className=className, eventId=event_id
+                )
+            ],
+            ignore_conflicts=True,
+        )
+
+    identity_map = request_identity_map(request)
+    if identity_map != None:
+        identity_map.checked_off = None
+    student_changed(request)
 
@@ -23,22 +23,27 @@ from django.core.validators import RegexValidator
 logger = logging.getLogger(__name__)
 
 # Create your views here.
-# NOTE ALWAYS use initialize_user(request) at the beginning of a view to make sure current user is valid
+# NOTE the student of a logged in user is created by mainapp.middleware.StudentMiddleware,
+# so views only have to check tools.student_exists(request)
 
 
 def index(request):
     """
     Basic home page
     """
-    tools.initialize_user(request)
     # this is now needed because calendar is required to view home page
+    # (it is created in the background, the page does not wait for it)
     tools.create_calendar(request)
     if tools.student_exists(request):
         todo = tools.todo_list(request)
         return render(
             request,
             "mainapp/index.html",
-            {"todo": mark_safe(todo), "has_todo": len(todo) != 0,},
+            {
+                "todo": mark_safe(todo),
+                "has_todo": len(todo) != 0,
+                "calendar_pending": tools.calendar_pending(request),
+            },
         )
     else:
         return render(request, "mainapp/index.html")
@@ -48,14 +53,14 @@ def calendar_view(request, month_id=None):
     """
     Shows calendar with events, and check marks for what events are to be deleted
     """
-    tools.initialize_user(request)
     # make a calendar for this user. If they already have a calendar, this will do nothing.
-    # if this is the null user, this will also do nothing. Will redirect home if calendar
-    # still failed creation
+    # if this is the null user, this will also do nothing. The calendar is created in the
+    # background, so until it is there the page shows a placeholder
     tools.create_calendar(request)
+    pending = tools.calendar_pending(request)
 
     # calendar failed to be created. head to index page
-    if not tools.calendar_exists(request):
+    if not tools.calendar_exists(request) and not pending:
         return HttpResponseRedirect(reverse("index"))
 
     # use today's date for the calendar
@@ -75,9 +80,10 @@ def calendar_view(request, month_id=None):
     cal = Calendar(d.year, d.month)
 
     # Call the formatmonth method, which returns our calendar as a table
-    html_cal = cal.formatmonth(request=request, withyear=True)
+    html_cal = "" if pending else cal.formatmonth(request=request, withyear=True)
     args = {}
     args["calendar"] = mark_safe(html_cal)
+    args["calendar_pending"] = pending
     args["next_month"] = month_id
 
     m = tools.get_date(request)
@@ -89,7 +95,6 @@ def prev_month(request, month_id):
     """
     Returns to previous month on calendar
     """
-    tools.initialize_user(request)
     return calendar_view(request, month_id=month_id - 1)
 
 
@@ -97,7 +102,6 @@ def next_month(request, month_id):
     """
     Returns to next month on calendar
     """
-    tools.initialize_user(request)
     return calendar_view(request, month_id=month_id + 1)
 
 
@@ -106,7 +110,6 @@ def classes(request):
     A list of classes associated with the current user
     """
     print(request.user.id)
-    tools.initialize_user(request)
 
     if not tools.student_exists(request):
         return HttpResponseRedirect(reverse("index"))
@@ -123,8 +126,6 @@ def remove_classes(request, className=None):
     """
     Hidden page that handles removing classes from classes view page
     """
-    tools.initialize_user(request)
-
     if not tools.student_exists(request):
         return HttpResponseRedirect(reverse("index"))
 
@@ -143,8 +144,6 @@ def all_classes(request):
     """
     A list of all registered classes
     """
-    tools.initialize_user(request)
-
     if not tools.student_exists(request):
         return HttpResponseRedirect(reverse("index"))
 
@@ -163,8 +162,6 @@ def add_classes(request, className):
     """
     Hidden page that handles adding classes from all_classes view page
     """
-    tools.initialize_user(request)
-
     if not tools.student_exists(request):
         return HttpResponseRedirect(reverse("index"))
 
@@ -183,8 +180,6 @@ def delete_assignment(request, className, event_id):
     """
     Hidden page that handles deleting (or checking off) assignments
     """
-    tools.initialize_user(request)
-
     if not tools.student_exists(request):
         return HttpResponseRedirect(reverse("index"))
 
@@ -199,7 +194,6 @@ def add_assignment(request, className=None):
     """
     Form page to add assignments to calendar
     """
-    tools.initialize_user(request)
     # if this is a post, then add assignment
     if not tools.student_exists(request):
         return HttpResponseRedirect(reverse("index"))
@@ -269,7 +263,7 @@ def add_assignment(request, className=None):
             if className == "None":
                 className = None
             print(form.data, "lookkie here <----------------")
-            tools.create_event(
+            created = tools.create_event(
                 request,
                 form.data["summary"],
                 form.data["est_time"],
@@ -281,17 +275,29 @@ def add_assignment(request, className=None):
                 className=className,
             )
 
-            # notify students of event creation, if class is not personal
-            if className != None:
-                tools.notify_students_of_change(
-                    className, form.data["summary"], "create"
+            if not created:
+                # most likely the calendar is still being set up in the background
+                if tools.calendar_pending(request):
+                    error = "Your calendar is being set up, try again in a few seconds."
+                else:
+                    error = "The assignment could not be added to your calendar."
+                form.add_error(None, error)
+            else:
+                # notify students of event creation, if class is not personal
+                # (in the background, so a big class does not hold up the redirect)
+                if className != None:
+                    tools.run_in_background(
+                        tools.notify_students_of_change,
+                        className,
+                        form.data["summary"],
+                        "create",
+                    )
+                # redirect to the calendar
+                if className == None:
+                    return HttpResponseRedirect(reverse("calendar"))
+                return HttpResponseRedirect(
+                    reverse("view_class", kwargs={"className": className})
                 )
-            # redirect to the calendar
-            if className == None:
-                return HttpResponseRedirect(reverse("calendar"))
-            return HttpResponseRedirect(
-                reverse("view_class", kwargs={"className": className})
-            )
 
     # create a blank form
     else:
@@ -306,8 +312,6 @@ def create_class(request):
     """
     View for creating a class. This view is **only** usable by a professor.
     """
-    tools.initialize_user(request)
-
     if not tools.student_exists(request):
         return HttpResponseRedirect(reverse("index"))
 
@@ -340,7 +344,6 @@ def upload_schedule(request, className):
     """
     View for creating a class. This view is **only** usable by a professor.
     """
-    tools.initialize_user(request)
     if not tools.student_exists(request):
         return HttpResponseRedirect(reverse("index"))
     # if this is a post, then upload a schedule
@@ -353,8 +356,18 @@ def upload_schedule(request, className):
         form = UploadSyllabus(request.POST, request.FILES)
         # check whether the form fits the constraints:
         if form.is_valid():
-            # save the class
-            tools.upload_syllabus(request, form, className)
+            # add the assignments. if any rows were skipped, show what happened to them
+            report = tools.upload_syllabus(request, form, className)
+            if len(report["failed"]) != 0 or len(report["duplicated"]) != 0:
+                return render(
+                    request,
+                    "mainapp/upload_schedule.html",
+                    {
+                        "form": UploadSyllabus(),
+                        "className": className,
+                        "report": report,
+                    },
+                )
             return HttpResponseRedirect(
                 reverse("view_class", kwargs={"className": className})
             )
@@ -369,7 +382,6 @@ def upload_schedule(request, className):
 
 
 def upload_file(request, className=None):
-    tools.initialize_user(request)
     if not tools.student_exists(request):
         return HttpResponseRedirect(reverse("index"))
 
@@ -401,7 +413,6 @@ def upload_file(request, className=None):
 
 
 def delete_file(request, pk, className=None):
-    tools.initialize_user(request)
 
     if not tools.student_exists(request):
         return HttpResponseRedirect(reverse("index"))
@@ -424,7 +435,6 @@ def file_list(request, className=None):
     """
     Displays a list of files for a certain class with name className
     """
-    tools.initialize_user(request)
     if not tools.student_exists(request):
         return HttpResponseRedirect(reverse("index"))
 
@@ -446,7 +456,6 @@ def view_class(request, className=None):
     """
     Shows the home page for a class
     """
-    tools.initialize_user(request)
     if not tools.student_exists(request):
         return HttpResponseRedirect(reverse("index"))
 
@@ -476,8 +485,6 @@ def change_color(request, className=None):
     Change the color for a class given the className
     The given request should have the color id
     """
-
-    tools.initialize_user(request)
     if not tools.student_exists(request):
         return HttpResponseRedirect(reverse("index"))
 
@@ -493,7 +500,6 @@ def todo_list(request):
     """
     The view for the todo list
     """
-    tools.initialize_user(request)
     if not tools.student_exists(request):
         return HttpResponseRedirect(reverse("index"))
 
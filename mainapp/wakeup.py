@@ -0,0 +1,92 @@
+import select
+import threading
+import time
+from django.db import connection, connections, transaction
+
+# postgres channel the daemon listens on for newly queued notifications
+CHANNEL = "notification_queued"
+
+# stand-in for the channel when the database is not postgres (sqlite, tests). It only
+# reaches listeners in the same process, other processes wait for the notification sweep
+queued = threading.Event()
+
+
+def cross_process():
+    """
+    Returns whether notify reaches listeners in other processes (on postgres it does)
+    """
+    return connection.vendor == "postgresql"
+
+
+def notify():
+    """
+    Wakes up the listeners waiting for notifications, once the current transaction commits
+    Call it whenever Notification rows are queued
+    """
+    if cross_process():
+        # postgres holds NOTIFY back until the commit, and sends it only once per transaction
+        with connection.cursor() as cursor:
+            cursor.execute(f"NOTIFY {CHANNEL}")
+    transaction.on_commit(queued.set)
+
+
+class Listener:
+    """
+    Sleeps until notifications are queued (see notify), so the daemon can send them right away
+    instead of polling the Notification table
+    On postgres it keeps a connection of its own that LISTENs on CHANNEL
+    """
+
+    def __init__(self):
+        self.connection = None
+
+    def connect(self):
+        """
+        Opens the listening connection, outside of django so it can stay in autocommit
+        """
+        import psycopg2
+        import psycopg2.extensions
+
+        listening = psycopg2.connect(**connections["default"].get_connection_params())
+        listening.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with listening.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+        return listening
+
+    def wait(self, timeout):
+        """
+        Waits up to timeout seconds for notifications to be queued
+        Returns whether there might be some to send
+        """
+        if not cross_process():
+            woken = queued.wait(timeout)
+            queued.clear()
+            return woken
+
+        try:
+            if self.connection == None:
+                self.connection = self.connect()
+                # anything queued while nobody was listening was not announced
+                return True
+            if len(self.connection.notifies) == 0:
+                select.select([self.connection], [], [], timeout)
+                self.connection.poll()
+            woken = len(self.connection.notifies) != 0
+            self.connection.notifies.clear()
+            return woken
+        except Exception:
+            print("Lost the notification listener connection, reconnecting")
+            self.close()
+            time.sleep(timeout)
+            return True
+
+    def close(self):
+        """
+        Closes the listening connection
+        """
+        if self.connection != None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None